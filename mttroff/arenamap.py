@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Arena maps for TROff - A Multitouch TRON Clone
+#
+# Copyright (C) 2011-2020 Thomas Schott, <scotty at c-base dot org>
+#
+# TROff is free software: You can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# TROff is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with TROff. If not, see <http://www.gnu.org/licenses/>.
+
+# A map file is a block of equally long rows of '#' (wall) and '.' (free) characters, lines
+# starting with ';' are comments. The map is stretched over the whole battleground, so every
+# character covers a rectangle of grid cells. Keep the corners (controllers, start positions) free.
+
+MAP_WALL = '#'
+MAP_FREE = '.'
+MAP_COMMENT = ';'
+
+
+def load_map(fp, name='map'):
+    rows = []
+    for line_no, line in enumerate(fp, 1):
+        line = line.strip()
+        if not line or line.startswith(MAP_COMMENT):
+            continue
+        if line.strip(MAP_WALL + MAP_FREE):
+            raise ValueError('%s:%d: invalid character in map row: %r' % (name, line_no, line))
+        if rows and len(line) != len(rows[0]):
+            raise ValueError('%s:%d: map rows differ in length' % (name, line_no))
+        rows.append([c == MAP_WALL for c in line])
+    if not rows:
+        raise ValueError('%s: empty map' % name)
+    return rows
+
+
+class WallGrid(object):
+    def __init__(self, map_rows, grid_size, cell_size):
+        # one flag per grid position, including the border positions
+        self.__width = int(grid_size[0]) + 1
+        self.__height = int(grid_size[1]) + 1
+        self.__cell_size = cell_size
+        self.__cells = bytearray(self.__width * self.__height)
+        self.__rects = []  # (x0, y0, x1, y1) grid position ranges, one per run of walls in a map row
+
+        map_w, map_h = len(map_rows[0]), len(map_rows)
+        for row_idx, row in enumerate(map_rows):
+            y0 = row_idx * self.__height / map_h
+            y1 = (row_idx + 1) * self.__height / map_h
+            col_idx = 0
+            while col_idx < map_w:
+                if not row[col_idx]:
+                    col_idx += 1
+                    continue
+                run_start = col_idx
+                while col_idx < map_w and row[col_idx]:
+                    col_idx += 1
+                x0 = run_start * self.__width / map_w
+                x1 = col_idx * self.__width / map_w
+                self.__rects.append((x0, y0, x1, y1))
+                for y in xrange(y0, y1):
+                    offset = y * self.__width
+                    self.__cells[offset + x0:offset + x1] = '\1' * (x1 - x0)
+
+    @property
+    def size(self):
+        return self.__width, self.__height
+
+    @property
+    def cells(self):
+        return self.__cells
+
+    @property
+    def rects(self):
+        return self.__rects
+
+    def is_wall(self, x, y):
+        if 0 <= x < self.__width and 0 <= y < self.__height:
+            return self.__cells[y * self.__width + x] != 0
+        return False
+
+    def check_collision(self, pos):
+        return self.is_wall(int(round(pos.x / self.__cell_size)), int(round(pos.y / self.__cell_size)))
+
+    def render(self, pixel_size, wall_pixel, free_pixel):
+        # pixels of an image covering pixel_size, every wall position drawn as a cell around it
+        w, h = int(pixel_size[0]), int(pixel_size[1])
+        half = self.__cell_size / 2
+        columns = [min((x + half) / self.__cell_size, self.__width - 1) for x in xrange(w)]
+        rows = []
+        row_cache = {}
+        for y in xrange(h):
+            grid_y = min((y + half) / self.__cell_size, self.__height - 1)
+            offset = grid_y * self.__width
+            cells = str(self.__cells[offset:offset + self.__width])
+            row = row_cache.get(cells)
+            if row is None:
+                row = row_cache[cells] = ''.join(
+                    wall_pixel if cells[x] != '\0' else free_pixel for x in columns
+                )
+            rows.append(row)
+        return ''.join(rows)
+
+
+class TrailGrid(object):
+    def __init__(self, grid_size, cell_size):
+        # number of trails on every grid position, including the border positions
+        self.__width = int(grid_size[0]) + 1
+        self.__cell_size = cell_size
+        self.__cells = bytearray(self.__width * (int(grid_size[1]) + 1))
+
+    @property
+    def cells(self):
+        return self.__cells
+
+    def __index(self, pos):
+        return int(round(pos.y / self.__cell_size)) * self.__width + int(round(pos.x / self.__cell_size))
+
+    def mark(self, pos):
+        self.__cells[self.__index(pos)] += 1
+
+    def unmark(self, pos):
+        self.__cells[self.__index(pos)] -= 1
+
+    def count(self, pos):
+        return self.__cells[self.__index(pos)]
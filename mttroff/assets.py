@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Asset bundle for TROff - A Multitouch TRON Clone
+#
+# Copyright (C) 2011-2020 Thomas Schott, <scotty at c-base dot org>
+#
+# TROff is free software: You can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# TROff is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with TROff. If not, see <http://www.gnu.org/licenses/>.
+
+# Packs the game assets into a single indexed file (built by setup.py, or for development by
+# running 'python assets.py'), which is memory-mapped at startup instead of looking up the loose files.
+#
+# Bundle layout (little endian):
+#   header: magic (8 bytes), version (uint32), number of entries (uint32)
+#   index:  per entry: name length (uint16), name (utf-8), data offset (uint32), data size (uint32)
+#   data:   the file contents, each entry aligned to BUNDLE_ALIGNMENT bytes
+#
+# Data files are served straight from the mapping. Sounds and fonts are loaded by libavg from file
+# names only, so they are written once into a RAM-backed directory and served from there.
+
+import errno
+import mmap
+import os
+import shutil
+import struct
+import sys
+import tempfile
+from cStringIO import StringIO
+from glob import glob
+
+
+BUNDLE_PATH = 'data/assets.bundle'
+BUNDLE_MAGIC = 'TROFFPAK'
+BUNDLE_VERSION = 1
+BUNDLE_ALIGNMENT = 16
+BUNDLED_FILES = ['media/*.wav', 'fonts/Ubuntu-R.ttf', 'data/*.pickle', 'data/maps/*.map']
+HEADER = struct.Struct('<8sII')
+INDEX_ENTRY = struct.Struct('<II')
+NAME_LENGTH = struct.Struct('<H')
+RAM_DIRS = ['/dev/shm', '/run/shm']
+
+
+def bundled_names(package_dir):
+    names = []
+    for pattern in BUNDLED_FILES:
+        for path in sorted(glob(os.path.join(package_dir, pattern))):
+            names.append(os.path.relpath(path, package_dir).replace(os.sep, '/'))
+    return names
+
+
+def build_bundle(package_dir, bundle_path):
+    names = bundled_names(package_dir)
+    index_size = HEADER.size + sum(NAME_LENGTH.size + len(name) + INDEX_ENTRY.size for name in names)
+    entries = []
+    offset = index_size
+    for name in names:
+        offset += -offset % BUNDLE_ALIGNMENT
+        size = os.path.getsize(os.path.join(package_dir, name))
+        entries.append((name, offset, size))
+        offset += size
+
+    with open(bundle_path, 'wb') as fp:
+        fp.write(HEADER.pack(BUNDLE_MAGIC, BUNDLE_VERSION, len(entries)))
+        for name, offset, size in entries:
+            fp.write(NAME_LENGTH.pack(len(name)) + name + INDEX_ENTRY.pack(offset, size))
+        for name, offset, size in entries:
+            fp.write('\0' * (offset - fp.tell()))
+            with open(os.path.join(package_dir, name), 'rb') as src:
+                fp.write(src.read())
+    return names
+
+
+class AssetBundle(object):
+    def __init__(self, path):
+        with open(path, 'rb') as fp:
+            self.__mmap = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        self.__path = path
+        self.__index = {}
+
+        magic, version, num_entries = HEADER.unpack_from(self.__mmap)
+        if magic != BUNDLE_MAGIC or version != BUNDLE_VERSION:
+            raise ValueError('%s: not a version %d asset bundle' % (path, BUNDLE_VERSION))
+        pos = HEADER.size
+        for i in xrange(num_entries):
+            name_length, = NAME_LENGTH.unpack_from(self.__mmap, pos)
+            pos += NAME_LENGTH.size
+            name = self.__mmap[pos:pos + name_length]
+            pos += name_length
+            offset, size = self.__index[name] = INDEX_ENTRY.unpack_from(self.__mmap, pos)
+            pos += INDEX_ENTRY.size
+            if offset + size > len(self.__mmap):
+                raise ValueError('%s: truncated asset bundle' % path)
+
+    @property
+    def names(self):
+        return self.__index.keys()
+
+    def get(self, name):
+        offset, size = self.__index[name]
+        return buffer(self.__mmap, offset, size)
+
+    def open(self, name):
+        # cStringIO reads from the buffer without copying it
+        return StringIO(self.get(name))
+
+    def extract(self, names, target_dir):
+        for name in names:
+            path = os.path.join(target_dir, *name.split('/'))
+            if os.path.isfile(path) and os.path.getsize(path) == self.__index[name][1]:
+                continue
+            try:
+                os.makedirs(os.path.dirname(path))
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+            tmp_path = path + '.%d' % os.getpid()
+            with open(tmp_path, 'wb') as fp:
+                fp.write(self.get(name))
+            os.rename(tmp_path, path)
+
+    def close(self):
+        self.__mmap.close()
+
+
+class Assets(object):
+    def __init__(self, package_dir, use_bundle=True):
+        self.__package_dir = package_dir
+        self.__bundle = None
+        self.__dir = package_dir
+
+        bundle_path = os.path.join(package_dir, BUNDLE_PATH)
+        if use_bundle and os.path.isfile(bundle_path):
+            try:
+                self.__open_bundle(bundle_path)
+            except (ValueError, struct.error, EnvironmentError) as e:
+                # the loose files stay available
+                sys.stderr.write('not using the asset bundle: %s\n' % e)
+                if self.__bundle is not None:
+                    self.__bundle.close()
+                self.__bundle = None
+                self.__dir = package_dir
+
+    @property
+    def is_bundled(self):
+        return self.__bundle is not None
+
+    @property
+    def mediadir(self):
+        return os.path.join(self.__dir, 'media')
+
+    @property
+    def fontdir(self):
+        return os.path.join(self.__dir, 'fonts')
+
+    def exists(self, name):
+        if self.__bundle is not None:
+            return name in self.__bundle.names
+        return os.path.isfile(os.path.join(self.__package_dir, *name.split('/')))
+
+    def open(self, name):
+        if self.__bundle is not None:
+            return self.__bundle.open(name)
+        return open(os.path.join(self.__package_dir, *name.split('/')), 'rb')
+
+    def __open_bundle(self, bundle_path):
+        self.__bundle = AssetBundle(bundle_path)
+        stat = os.stat(bundle_path)
+        ram_dir = self.__ram_dir()
+        prefix = 'troff-assets-%d-' % os.getuid()
+        self.__dir = os.path.join(ram_dir, prefix + '%d-%d' % (stat.st_ino, stat.st_mtime))
+        # the files extracted from earlier bundles
+        for path in glob(os.path.join(ram_dir, prefix + '*')):
+            if path != self.__dir:
+                shutil.rmtree(path, True)
+        self.__bundle.extract(
+            [name for name in self.__bundle.names if not name.startswith('data/')], self.__dir
+        )
+
+    @staticmethod
+    def __ram_dir():
+        for path in RAM_DIRS:
+            if os.path.isdir(path) and os.access(path, os.W_OK):
+                return path
+        return tempfile.gettempdir()
+
+
+if __name__ == '__main__':
+    package_dir = os.path.dirname(os.path.abspath(__file__))
+    bundle_path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(package_dir, BUNDLE_PATH)
+    for name in build_bundle(package_dir, bundle_path):
+        print name
@@ -0,0 +1,284 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Input load generator for TROff - A Multitouch TRON Clone
+#
+# Copyright (C) 2011-2020 Thomas Schott, <scotty at c-base dot org>
+#
+# TROff is free software: You can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# TROff is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with TROff. If not, see <http://www.gnu.org/licenses/>.
+
+# Runs the game with fake multitouch input injected through the libavg test helper and
+# reports the cost of the touch handlers and the event-to-frame latency (from injecting an event
+# to the start of the next frame, the rendering of its effect is not included), e.g.:
+#
+#   python loadgen.py --loadgen-cursors=40 --loadgen-frames=3000
+#   python loadgen.py --loadgen-script=session.txt --loadgen-max-latency=50
+#
+# Without a display, run it through xvfb-run. The exit status is 1 if a given limit is exceeded.
+# The quit buttons only count their taps, the game stops after the given number of frames.
+#
+# Script files contain one event per line: '<frame> <cursor id> down|motion|up <x> <y>',
+# with x and y relative to the screen size (0..1). Empty lines and lines starting with '#' are ignored.
+
+import sys
+from random import Random
+from time import time
+from libavg import avg, Point2D, player, app
+
+from troff import TROff, Button, RealPlayer, DragItem, Shield
+
+
+FAKE_FPS = 60
+# handlers subscribed to cursor events (directly or via lambdas), as (class, attribute name)
+PROBED_HANDLERS = [
+    (Button, '_Button__on_down'),
+    (Button, '_Button__on_up'),
+    (RealPlayer, 'change_heading'),
+    (DragItem, '_on_down'),
+    (DragItem, '_DragItem__on_up'),
+    (DragItem, '_DragItem__on_motion'),
+    (Shield, '_on_down'),
+    (TROff, '_TROff__restart_idle_timer'),
+    (TROff, '_TROff__stop_idle_demo'),
+]
+EVENT_TYPES = {
+    'down': avg.Event.CURSOR_DOWN,
+    'motion': avg.Event.CURSOR_MOTION,
+    'up': avg.Event.CURSOR_UP,
+}
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+class HandlerProbe(object):
+    def __init__(self):
+        self.__originals = []
+        self.__costs = {}
+        self.__injected = {}  # cursor id -> injection time of the last event
+        self.__handled = []  # injection times of events handled since the last frame
+        self.latencies = []
+
+    @property
+    def costs(self):
+        return self.__costs
+
+    def install(self):
+        # must be called before the game nodes are created: handlers are bound on subscription
+        for cls, name in PROBED_HANDLERS:
+            func = cls.__dict__[name]
+            self.__originals.append((cls, name, func))
+            self.__costs['%s.%s' % (cls.__name__, name.split('__')[-1])] = []
+            setattr(cls, name, self.__wrap(cls, name, func))
+
+    def uninstall(self):
+        for cls, name, func in self.__originals:
+            setattr(cls, name, func)
+        self.__originals = []
+
+    def injected(self, cursor_id):
+        self.__injected[cursor_id] = time()
+
+    def frame(self):
+        # effects of the events handled during the last frame are visible now
+        now = time()
+        for inject_time in self.__handled:
+            self.latencies.append(now - inject_time)
+        self.__handled = []
+
+    def __wrap(self, cls, name, func):
+        costs = self.__costs['%s.%s' % (cls.__name__, name.split('__')[-1])]
+
+        def probe(*args, **kwargs):
+            if len(args) > 1:
+                inject_time = self.__injected.pop(getattr(args[1], 'cursorid', None), None)
+                if inject_time is not None:
+                    self.__handled.append(inject_time)
+            start = time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                costs.append(time() - start)
+
+        return probe
+
+
+class RandomLoad(object):
+    def __init__(self, num_cursors, seed, screen_size):
+        self.__random = Random(seed)
+        self.__screen_size = screen_size
+        self.__next_id = 1000
+        self.__cursors = []
+        for i in xrange(num_cursors):
+            # staggered start, so cursors don't all go down in the same frame
+            self.__cursors.append([None, None, None, self.__random.randint(0, 30)])
+
+    def events(self, frame):
+        events = []
+        for cursor in self.__cursors:
+            cursor_id, pos, speed, ttl = cursor
+            if cursor_id is None:
+                if ttl > 0:
+                    cursor[3] -= 1
+                    continue
+                cursor[0] = cursor_id = self.__next_id
+                self.__next_id += 1
+                cursor[1] = pos = Point2D(
+                    self.__random.uniform(0, self.__screen_size.x), self.__random.uniform(0, self.__screen_size.y)
+                )
+                cursor[2] = Point2D(self.__random.uniform(-20, 20), self.__random.uniform(-20, 20))
+                cursor[3] = self.__random.randint(5, 120)
+                events.append((cursor_id, avg.Event.CURSOR_DOWN, pos))
+            elif ttl == 0:
+                events.append((cursor_id, avg.Event.CURSOR_UP, pos))
+                cursor[:] = [None, None, None, self.__random.randint(0, 30)]
+            else:
+                cursor[1] = pos = Point2D(
+                    min(max(pos.x + speed.x, 0), self.__screen_size.x - 1),
+                    min(max(pos.y + speed.y, 0), self.__screen_size.y - 1)
+                )
+                cursor[3] -= 1
+                events.append((cursor_id, avg.Event.CURSOR_MOTION, pos))
+        return events
+
+
+class ScriptedLoad(object):
+    def __init__(self, path, screen_size):
+        self.__frames = {}
+        with open(path, 'r') as fp:
+            for line_no, line in enumerate(fp, 1):
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                try:
+                    frame, cursor_id, type_, x, y = line.split()
+                    event = (int(cursor_id), EVENT_TYPES[type_],
+                             Point2D(float(x) * screen_size.x, float(y) * screen_size.y))
+                    self.__frames.setdefault(int(frame), []).append(event)
+                except (ValueError, KeyError):
+                    raise ValueError('%s:%d: invalid event: %r' % (path, line_no, line))
+
+    def events(self, frame):
+        return self.__frames.get(frame, [])
+
+
+class LoadGenTROff(TROff):
+    def __init__(self, probe, **kwargs):
+        super(LoadGenTROff, self).__init__(**kwargs)
+        self.__probe = probe
+        self.__options = None
+        self.__load = None
+        self.__frame = 0
+        self.__num_events = 0
+        self.__num_quits = 0
+
+    @property
+    def num_events(self):
+        return self.__num_events
+
+    @property
+    def num_quits(self):
+        return self.__num_quits
+
+    @property
+    def options(self):
+        return self.__options
+
+    def onArgvParserCreated(self, parser):
+        super(LoadGenTROff, self).onArgvParserCreated(parser)
+        parser.add_option('--loadgen-cursors', type='int', default=30, help='number of random cursors')
+        parser.add_option('--loadgen-frames', type='int', default=1800, help='number of frames to run')
+        parser.add_option('--loadgen-seed', type='int', default=0, help='seed for the random cursors')
+        parser.add_option('--loadgen-script', default=None, help='replay cursor events from a script file')
+        parser.add_option('--loadgen-max-latency', type='float', default=None,
+                          help='fail if the 95th percentile event-to-frame latency exceeds this (ms)')
+        parser.add_option('--loadgen-max-handler', type='float', default=None,
+                          help='fail if the 95th percentile cost of a handler exceeds this (ms)')
+
+    def onArgvParsed(self, options, args, parser):
+        super(LoadGenTROff, self).onArgvParsed(options, args, parser)
+        self.__options = options
+
+    def onStartup(self):
+        super(LoadGenTROff, self).onStartup()
+        player.setFakeFPS(FAKE_FPS)
+
+    def onInit(self):
+        super(LoadGenTROff, self).onInit()
+        screen_size = player.getRootNode().size
+        if self.__options.loadgen_script is not None:
+            self.__load = ScriptedLoad(self.__options.loadgen_script, screen_size)
+        else:
+            self.__load = RandomLoad(self.__options.loadgen_cursors, self.__options.loadgen_seed, screen_size)
+        player.subscribe(player.ON_FRAME, self.__on_frame)
+
+    def _quit(self):
+        self.__num_quits += 1
+
+    def __on_frame(self):
+        self.__probe.frame()
+        if self.__frame == self.__options.loadgen_frames:
+            player.stop()
+            return
+        helper = player.getTestHelper()
+        for cursor_id, type_, pos in self.__load.events(self.__frame):
+            helper.fakeTouchEvent(cursor_id, type_, avg.Event.TOUCH, pos)
+            self.__probe.injected(cursor_id)
+            self.__num_events += 1
+        self.__frame += 1
+
+
+def report(probe, num_events, num_quits, options):
+    def ms(seconds):
+        return seconds * 1000
+
+    failed = False
+    print '%-32s %8s %10s %8s %8s %8s' % ('handler', 'calls', 'total ms', 'mean ms', 'p95 ms', 'max ms')
+    for name, costs in sorted(probe.costs.iteritems(), key=lambda (n, c): -sum(c)):
+        if not costs:
+            print '%-32s %8d' % (name, 0)
+            continue
+        p95 = ms(percentile(costs, 0.95))
+        print '%-32s %8d %10.2f %8.3f %8.3f %8.3f' % (
+            name, len(costs), ms(sum(costs)), ms(sum(costs) / len(costs)), p95, ms(max(costs))
+        )
+        if options.loadgen_max_handler is not None and p95 > options.loadgen_max_handler:
+            failed = True
+
+    latencies = probe.latencies
+    print
+    print 'injected events: %d, handled: %d, quit button taps (ignored): %d' % (
+        num_events, len(latencies), num_quits
+    )
+    if latencies:
+        p95 = ms(percentile(latencies, 0.95))
+        print 'event-to-frame latency (rendering not included): mean %.2f ms, p95 %.2f ms, max %.2f ms' % (
+            ms(sum(latencies) / len(latencies)), p95, ms(max(latencies))
+        )
+        if options.loadgen_max_latency is not None and p95 > options.loadgen_max_latency:
+            failed = True
+    return failed
+
+
+if __name__ == '__main__':
+    probe = HandlerProbe()
+    probe.install()
+    main_div = LoadGenTROff(probe)
+    app.App().run(main_div, app_resolution='1280x720', app_fullscreen='false')
+    probe.uninstall()
+    sys.exit(1 if report(probe, main_div.num_events, main_div.num_quits, main_div.options) else 0)
@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Game state snapshots for TROff - A Multitouch TRON Clone
+#
+# Copyright (C) 2011-2020 Thomas Schott, <scotty at c-base dot org>
+#
+# TROff is free software: You can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# TROff is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with TROff. If not, see <http://www.gnu.org/licenses/>.
+
+# Snapshots are immutable tuples, so they can be kept without copying anything. A line no longer
+# changes once its player turned, the finished lines of a player are therefore kept in a linked list
+# of (line, older lines) pairs, newest first, which every later snapshot shares. Taking a snapshot
+# only copies the head, the current line and (for retracting trails) the oldest line.
+
+from collections import namedtuple
+
+
+# positions and lines as (x, y) and ((x1, y1), (x2, y2)) tuples
+PlayerSnapshot = namedtuple(
+    'PlayerSnapshot', 'idx crashed head heading current_line finished_lines num_finished oldest_line'
+)
+GameSnapshot = namedtuple('GameSnapshot', 'tick players shield shield_owner blocker wins')
+
+
+def push_line(finished_lines, line):
+    return line, finished_lines
+
+
+def trail_lines(player_snapshot):
+    # the trail as it was at the snapshot, newest line first
+    lines = [player_snapshot.current_line]
+    finished_lines = player_snapshot.finished_lines
+    for i in xrange(player_snapshot.num_finished):
+        line, finished_lines = finished_lines
+        lines.append(line)
+    if player_snapshot.oldest_line is not None:
+        lines[-1] = player_snapshot.oldest_line  # the tail has retracted since the line was finished
+    return lines
@@ -0,0 +1,454 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Game rules simulation process for TROff - A Multitouch TRON Clone
+#
+# Copyright (C) 2011-2020 Thomas Schott, <scotty at c-base dot org>
+#
+# TROff is free software: You can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# TROff is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with TROff. If not, see <http://www.gnu.org/licenses/>.
+
+# Started with '--simulation-rate=HZ', the game rules run in a separate process at a fixed tick rate,
+# so rendering stalls and garbage collection in the game process no longer affect the game timing.
+# Both processes share two anonymous memory mappings (positions in grid units, little endian):
+#
+# - the input ring, written by the game process only: a single producer single consumer ring of
+#   commands (joins, round starts, turns, shield/blocker moves). The producer only ever writes the
+#   head index, the consumer only the tail index.
+# - the state buffer, written by the simulation process only, guarded by a sequence counter that is
+#   odd while the buffer is written; readers retry (up to READ_RETRIES times) until they copied it
+#   between two equal even counts. Per player it holds the head, the alive flag, the number of
+#   shield crossings and the turn positions of the round. Crashes, crossings and shield grabs are
+#   published as these flags and counters (and the shield owner and number of shield releases), so a
+#   reader that skips ticks never misses an event.
+#   Turn positions are only appended during a round, readers copy the new ones.
+# The ring indices and the sequence counter are only read and written while holding a lock shared
+# by both processes, whose acquire and release are the memory barriers that order them against the
+# slot and state contents (plain stores are not ordered on e.g. ARM). The lock is held for a single
+# index access only; a process that can't get it within HANDOFF_TIMEOUT (the other one died
+# holding it) treats the access as failed.
+#
+# The rules are those of the game process with a trail grid: a head crashes into the border, walls,
+# the blocker (unless dragged) and every trail position, the shield lets its owner cross one trail.
+# Shield and blocker positions stay owned by the game process; after the shield owner crossed a
+# trail or crashed, the shield is unavailable until the game process sends its new position.
+
+import os
+import struct
+import time
+from collections import namedtuple
+from mmap import mmap
+from multiprocessing import Lock, Process
+
+
+NUM_PLAYERS = 4
+MAX_TURNS = 4096  # per player and round, later turns are ignored
+INPUT_CAPACITY = 256
+MAX_LAG = 0.25  # seconds, the simulation doesn't catch up on longer stalls
+READ_RETRIES = 1000  # a writer that died while writing leaves the sequence counter odd
+HANDOFF_TIMEOUT = 0.1  # seconds
+
+CMD_JOIN = 1  # player
+CMD_START = 2  # x: round number (mod 256), starts the joined players
+CMD_TURN = 3  # player, value: heading change (1: left, -1: right)
+CMD_ITEM = 4  # item, value: dragged, x, y
+CMD_QUIT = 5
+
+ITEM_SHIELD = 0
+ITEM_BLOCKER = 1
+
+RING_INDICES = struct.Struct('<II')
+RING_INDEX = struct.Struct('<I')
+RING_SLOT = struct.Struct('<BBbxhh')
+SEQUENCE = struct.Struct('<I')
+STATE_HEADER = struct.Struct('<BxxxIbxH')
+STATE_PLAYER = struct.Struct('<BxHhhH')
+POINT = struct.Struct('<hh')
+
+# shield_released: the shield owner lost the shield since the last read, it waits for a new position
+SimulationState = namedtuple('SimulationState', 'tick shield_owner shield_released players')
+# turns: the turn positions since the last read, crossings: the shield crossings since the last read
+PlayerState = namedtuple('PlayerState', 'alive head turns crossings')
+
+
+def locked_load(lock, struct_, buf, offset=0):
+    # None if the lock couldn't be acquired
+    if not lock.acquire(True, HANDOFF_TIMEOUT):
+        return None
+    try:
+        return struct_.unpack_from(buf, offset)
+    finally:
+        lock.release()
+
+
+def locked_store(lock, struct_, buf, offset, *values):
+    # False if the lock couldn't be acquired
+    if not lock.acquire(True, HANDOFF_TIMEOUT):
+        return False
+    try:
+        struct_.pack_into(buf, offset, *values)
+    finally:
+        lock.release()
+    return True
+
+
+class SpscRing(object):
+    def __init__(self, buf, lock, capacity=INPUT_CAPACITY):
+        self.__buf = buf
+        self.__lock = lock
+        self.__capacity = capacity
+
+    @staticmethod
+    def buffer_size(capacity=INPUT_CAPACITY):
+        return RING_INDICES.size + RING_SLOT.size * capacity
+
+    def push(self, cmd, idx=0, value=0, x=0, y=0):
+        indices = locked_load(self.__lock, RING_INDICES, self.__buf)
+        if indices is None:
+            return False
+        head, tail = indices
+        if head - tail >= self.__capacity:
+            return False
+        RING_SLOT.pack_into(
+            self.__buf, RING_INDICES.size + RING_SLOT.size * (head % self.__capacity), cmd, idx, value, x, y
+        )
+        # publish the slot, written after its contents
+        return locked_store(self.__lock, RING_INDEX, self.__buf, 0, (head + 1) & 0xffffffff)
+
+    def pop_all(self):
+        indices = locked_load(self.__lock, RING_INDICES, self.__buf)
+        if indices is None:
+            return []
+        head, tail = indices
+        commands = []
+        while tail != head:
+            commands.append(
+                RING_SLOT.unpack_from(self.__buf, RING_INDICES.size + RING_SLOT.size * (tail % self.__capacity))
+            )
+            tail = (tail + 1) & 0xffffffff
+        if not locked_store(self.__lock, RING_INDEX, self.__buf, RING_INDEX.size, tail):
+            return []  # the commands stay in the ring
+        return commands
+
+
+class SharedState(object):
+    def __init__(self, buf, lock, num_players=NUM_PLAYERS):
+        self.__buf = buf
+        self.__lock = lock
+        self.__num_players = num_players
+        self.__players_offset = SEQUENCE.size + STATE_HEADER.size
+        self.__turns_offset = self.__players_offset + STATE_PLAYER.size * num_players
+        self.__written_turns = [0] * num_players
+        self.__written_round = None
+
+    @staticmethod
+    def buffer_size(num_players=NUM_PLAYERS):
+        return SEQUENCE.size + STATE_HEADER.size + (STATE_PLAYER.size + POINT.size * MAX_TURNS) * num_players
+
+    def write(self, round_, tick, shield_owner, shield_releases, players):
+        # players: (alive, crossings, (x, y), turn positions)
+        sequence, = SEQUENCE.unpack_from(self.__buf)
+        if not locked_store(self.__lock, SEQUENCE, self.__buf, 0, (sequence + 1) & 0xffffffff):
+            return
+        if round_ != self.__written_round:
+            self.__written_round = round_
+            self.__written_turns = [0] * self.__num_players
+        STATE_HEADER.pack_into(self.__buf, SEQUENCE.size, round_, tick, shield_owner, shield_releases)
+        for idx, (alive, crossings, head, turns) in enumerate(players):
+            STATE_PLAYER.pack_into(
+                self.__buf, self.__players_offset + STATE_PLAYER.size * idx,
+                alive, crossings, head[0], head[1], len(turns)
+            )
+            offset = self.__turns_offset + POINT.size * MAX_TURNS * idx
+            for turn_idx in xrange(self.__written_turns[idx], len(turns)):
+                POINT.pack_into(self.__buf, offset + POINT.size * turn_idx, *turns[turn_idx])
+            self.__written_turns[idx] = len(turns)
+        locked_store(self.__lock, SEQUENCE, self.__buf, 0, (sequence + 2) & 0xffffffff)
+
+    def read(self, known_turns):
+        # (round, tick, shield owner, shield releases,
+        #  [(alive, crossings, head, turn positions after known_turns)]), None if no consistent copy was made
+        for i in xrange(READ_RETRIES):
+            sequence = locked_load(self.__lock, SEQUENCE, self.__buf)
+            if sequence is None:
+                return None
+            sequence, = sequence
+            if sequence & 1:
+                continue
+            header = self.__buf[SEQUENCE.size:self.__turns_offset]
+            round_, tick, shield_owner, shield_releases = STATE_HEADER.unpack_from(header)
+            players = []
+            for idx in xrange(self.__num_players):
+                alive, crossings, x, y, num_turns = STATE_PLAYER.unpack_from(
+                    header, STATE_HEADER.size + STATE_PLAYER.size * idx
+                )
+                offset = self.__turns_offset + POINT.size * MAX_TURNS * idx
+                turns = self.__buf[offset + POINT.size * known_turns[idx]:offset + POINT.size * num_turns]
+                players.append((alive, crossings, (x, y), turns))
+            if locked_load(self.__lock, SEQUENCE, self.__buf) == (sequence,):
+                break
+        else:
+            return None
+
+        for idx, (alive, crossings, head, turns) in enumerate(players):
+            players[idx] = (
+                alive, crossings, head,
+                [POINT.unpack_from(turns, offset) for offset in xrange(0, len(turns), POINT.size)]
+            )
+        return round_, tick, shield_owner, shield_releases, players
+
+
+class Simulation(object):
+    def __init__(self, grid_size, starts, wall_cells=None):
+        # starts: ((x, y), (dx, dy)) start position and heading per player
+        self.__max_x, self.__max_y = int(grid_size[0]), int(grid_size[1])
+        self.__width = self.__max_x + 1
+        self.__starts = starts
+        self.__wall_cells = bytearray(wall_cells) if wall_cells is not None else None
+        self.__trail_cells = bytearray(self.__width * (self.__max_y + 1))
+
+        self.__round = 0
+        self.__tick = 0
+        self.__running = False
+        self.__joined = []
+        self.__active = []
+        self.__alive = [0] * len(starts)
+        self.__crossings = [0] * len(starts)
+        self.__heads = [start[0] for start in starts]
+        self.__headings = [start[1] for start in starts]
+        self.__turns = [[] for start in starts]
+        self.__trails = [[] for start in starts]
+
+        self.__shield = None  # None: unavailable until the game process places it
+        self.__shield_dragged = False
+        self.__shield_owner = -1
+        self.__shield_releases = 0
+        self.__blocker = None
+        self.__blocker_dragged = False
+
+    @property
+    def running(self):
+        return self.__running
+
+    def handle(self, cmd, idx, value, x, y):
+        if cmd == CMD_JOIN:
+            self.__joined.append(idx)
+        elif cmd == CMD_START:
+            self.__start(x)
+        elif cmd == CMD_TURN:
+            self.__turn(idx, value)
+        elif cmd == CMD_ITEM:
+            if idx == ITEM_SHIELD:
+                if self.__shield_owner == -1:
+                    self.__shield = (x, y)
+                    self.__shield_dragged = bool(value)
+            else:
+                self.__blocker = (x, y)
+                self.__blocker_dragged = bool(value)
+
+    def step(self):
+        for idx in self.__active:
+            x, y = self.__heads[idx]
+            dx, dy = self.__headings[idx]
+            self.__heads[idx] = x + dx, y + dy
+            self.__mark(idx, self.__heads[idx])
+
+        crashed = [idx for idx in self.__active if self.__check_crash(idx)]
+        for idx in crashed:
+            self.__alive[idx] = 0
+            self.__active.remove(idx)
+            for pos in self.__trails[idx]:
+                self.__trail_cells[pos[1] * self.__width + pos[0]] -= 1
+            self.__trails[idx] = []
+            if self.__shield_owner == idx:
+                self.__release_shield()
+
+        if len(self.__active) <= 1:
+            self.__running = False
+        else:
+            for idx in self.__active:
+                if self.__shield_owner == -1 and not self.__shield_dragged \
+                        and self.__is_near(self.__shield, self.__heads[idx]):
+                    self.__shield_owner = idx
+        self.__tick += 1
+
+    def write(self, state):
+        state.write(self.__round, self.__tick, self.__shield_owner, self.__shield_releases, [
+            (self.__alive[idx], self.__crossings[idx], self.__heads[idx], self.__turns[idx])
+            for idx in xrange(len(self.__starts))
+        ])
+
+    def __start(self, round_):
+        self.__round = round_
+        self.__tick = 0
+        self.__trail_cells = bytearray(len(self.__trail_cells))
+        self.__active = self.__joined
+        self.__joined = []
+        for idx, (pos, heading) in enumerate(self.__starts):
+            self.__alive[idx] = 1 if idx in self.__active else 0
+            self.__crossings[idx] = 0
+            self.__heads[idx] = pos
+            self.__headings[idx] = heading
+            self.__turns[idx] = []
+            self.__trails[idx] = []
+            if self.__alive[idx]:
+                self.__mark(idx, pos)
+        self.__shield_owner = -1
+        self.__running = len(self.__active) > 1
+
+    def __turn(self, idx, heading):
+        if not self.__running or idx not in self.__active or len(self.__turns[idx]) == MAX_TURNS:
+            return
+        dx, dy = self.__headings[idx]
+        if dx == 0:
+            self.__headings[idx] = heading * dy, 0
+        else:
+            self.__headings[idx] = 0, -heading * dx
+        self.__turns[idx].append(self.__heads[idx])
+
+    def __mark(self, idx, pos):
+        x, y = pos
+        if 0 <= x <= self.__max_x and 0 <= y <= self.__max_y:
+            self.__trail_cells[y * self.__width + x] += 1
+            self.__trails[idx].append(pos)
+
+    def __check_crash(self, idx):
+        x, y = pos = self.__heads[idx]
+        # check border
+        if x <= 0 or y <= 0 or x >= self.__max_x or y >= self.__max_y:
+            return True
+        cell = y * self.__width + x
+        # check static walls
+        if self.__wall_cells is not None and self.__wall_cells[cell]:
+            return True
+        # check blocker
+        if not self.__blocker_dragged and self.__is_near(self.__blocker, pos):
+            return True
+        # check trail positions (counting the own head)
+        if self.__trail_cells[cell] > 1:
+            if self.__shield_owner != idx:
+                return True
+            self.__crossings[idx] = (self.__crossings[idx] + 1) & 0xffff
+            self.__release_shield()
+        return False
+
+    def __release_shield(self):
+        self.__shield_owner = -1
+        self.__shield_releases = (self.__shield_releases + 1) & 0xffff
+        self.__shield = None
+
+    @staticmethod
+    def __is_near(item_pos, pos):
+        return item_pos is not None and abs(item_pos[0] - pos[0]) <= 1 and abs(item_pos[1] - pos[1]) <= 1
+
+
+def run_simulation(rate, inputs, state, simulation):
+    parent_pid = os.getppid()
+    interval = 1.0 / rate
+    next_tick = time.time()
+    while os.getppid() == parent_pid:
+        for command in inputs.pop_all():
+            if command[0] == CMD_QUIT:
+                return
+            simulation.handle(*command)
+        if simulation.running:
+            simulation.step()
+        simulation.write(state)
+
+        next_tick += interval
+        delay = next_tick - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        elif delay < -MAX_LAG:
+            next_tick = time.time()
+
+
+class SimulationProcess(object):
+    def __init__(self, rate, grid_size, starts, wall_cells=None):
+        # anonymous shared mappings, inherited by the forked simulation process
+        self.__inputs = SpscRing(mmap(-1, SpscRing.buffer_size()), Lock())
+        self.__state = SharedState(mmap(-1, SharedState.buffer_size(len(starts))), Lock(), len(starts))
+        self.__pending = []  # commands that didn't fit into the input ring
+        self.__items = {}
+        self.__round = 0
+        self.__known_turns = [0] * len(starts)
+        self.__known_crossings = [0] * len(starts)
+        self.__known_releases = 0
+
+        simulation = Simulation(grid_size, starts, wall_cells)
+        simulation.write(self.__state)
+        self.__process = Process(target=run_simulation, args=(rate, self.__inputs, self.__state, simulation))
+        self.__process.daemon = True
+        self.__process.start()
+
+    @property
+    def is_alive(self):
+        return self.__process.is_alive()
+
+    def close(self):
+        self.__send(CMD_QUIT)
+        self.__process.join(1)
+        if self.__process.is_alive():
+            self.__process.terminate()
+
+    def start_round(self, players):
+        # players: indices in joining order
+        self.__round = (self.__round + 1) & 0xff
+        self.__known_turns = [0] * len(self.__known_turns)
+        self.__known_crossings = [0] * len(self.__known_crossings)
+        self.__items = {}
+        for idx in players:
+            self.__send(CMD_JOIN, idx)
+        self.__send(CMD_START, x=self.__round)
+
+    def turn(self, idx, heading):
+        self.__send(CMD_TURN, idx, heading)
+
+    def move_item(self, item, pos, dragged):
+        # only changes are sent
+        state = (int(round(pos[0])), int(round(pos[1])), bool(dragged))
+        if self.__items.get(item) != state:
+            self.__items[item] = state
+            self.__send(CMD_ITEM, item, state[2], state[0], state[1])
+
+    def read_state(self):
+        # None until the simulation started the current round, and after the simulation process died
+        if not self.__process.is_alive():
+            return None
+        self.__flush()
+        state = self.__state.read(self.__known_turns)
+        if state is None:
+            return None
+        round_, tick, shield_owner, shield_releases, players = state
+        if round_ != self.__round:
+            return None
+        shield_released = shield_releases != self.__known_releases
+        self.__known_releases = shield_releases
+        if shield_released:
+            self.__items.pop(ITEM_SHIELD, None)  # resend the position, even if it didn't change
+        player_states = []
+        for idx, (alive, crossings, head, turns) in enumerate(players):
+            player_states.append(PlayerState(
+                alive, head, turns, (crossings - self.__known_crossings[idx]) & 0xffff
+            ))
+            self.__known_turns[idx] += len(turns)
+            self.__known_crossings[idx] = crossings
+        return SimulationState(tick, shield_owner, shield_released, player_states)
+
+    def __send(self, cmd, idx=0, value=0, x=0, y=0):
+        self.__pending.append((cmd, idx, value, x, y))
+        self.__flush()
+
+    def __flush(self):
+        while self.__pending and self.__inputs.push(*self.__pending[0]):
+            self.__pending.pop(0)
@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Soak test harness for TROff - A Multitouch TRON Clone
+#
+# Copyright (C) 2011-2020 Thomas Schott, <scotty at c-base dot org>
+#
+# TROff is free software: You can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# TROff is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with TROff. If not, see <http://www.gnu.org/licenses/>.
+
+# Plays matches and idle demo cycles in accelerated (fake) time and samples scene node counts,
+# live Python objects by type, active subscriptions, pending timers and RSS at the end of every
+# cycle, e.g.:
+#
+#   python soak.py --soak-hours=8
+#
+# Without a display, run it through xvfb-run. The exit status is 1 if any of the sampled values
+# keeps growing, i.e. all samples of the last third exceed all samples of the first third.
+
+import gc
+import os
+import sys
+from random import Random
+from libavg import avg, Point2D, player, app
+
+import troff
+from troff import TROff, Controller, IDLE_TIMEOUT
+from loadgen import FAKE_FPS
+
+
+MATCH_FRAMES = FAKE_FPS * 60
+IDLE_FRAMES = FAKE_FPS * 30 + IDLE_TIMEOUT * FAKE_FPS / 1000
+CURSOR_MESSAGES = [avg.Node.CURSOR_DOWN, avg.Node.CURSOR_UP, avg.Node.CURSOR_MOTION]
+WARMUP_CYCLES = 3
+# allowed growth of the last third over the first third of the samples
+OBJECT_TOLERANCE = 50
+RSS_TOLERANCE = 1.1
+
+
+class PlayerProxy(object):
+    # stands in for libavg's player in the troff module to keep track of pending timers
+    def __init__(self, player_):
+        self.__player = player_
+        self.__timers = set()
+
+    @property
+    def num_timers(self):
+        return len(self.__timers)
+
+    def __getattr__(self, name):
+        return getattr(self.__player, name)
+
+    def setTimeout(self, time, func):
+        def fire():
+            self.__timers.discard(timer_id[0])
+            func()
+
+        timer_id = [self.__player.setTimeout(time, fire)]
+        self.__timers.add(timer_id[0])
+        return timer_id[0]
+
+    def setInterval(self, time, func):
+        timer_id = self.__player.setInterval(time, func)
+        self.__timers.add(timer_id)
+        return timer_id
+
+    def clearInterval(self, timer_id):
+        self.__timers.discard(timer_id)
+        return self.__player.clearInterval(timer_id)
+
+
+def walk_nodes(node):
+    yield node
+    if isinstance(node, avg.DivNode):
+        for i in xrange(node.getNumChildren()):
+            for child in walk_nodes(node.getChild(i)):
+                yield child
+
+
+def rss_kbytes():
+    try:
+        with open('/proc/self/statm', 'r') as fp:
+            return int(fp.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024
+    except (IOError, OSError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class SoakTROff(TROff):
+    def __init__(self, player_proxy, **kwargs):
+        super(SoakTROff, self).__init__(**kwargs)
+        self.__player_proxy = player_proxy
+        self.__random = Random(0)
+        self.__options = None
+        self.__controllers = None
+        self.__num_cycles = 0
+        self.__frame = 0
+        self.__events = {}  # frame -> [(cursor id, event type, pos)]
+        self.__next_cursor_id = 1000
+        self.samples = []  # [{value name: value}]
+
+    def onArgvParserCreated(self, parser):
+        super(SoakTROff, self).onArgvParserCreated(parser)
+        parser.add_option('--soak-hours', type='float', default=4, help='simulated time to run (hours)')
+        parser.add_option('--soak-seed', type='int', default=0, help='seed for the random turns')
+
+    def onArgvParsed(self, options, args, parser):
+        super(SoakTROff, self).onArgvParsed(options, args, parser)
+        self.__options = options
+
+    def onStartup(self):
+        super(SoakTROff, self).onStartup()
+        player.setFakeFPS(FAKE_FPS)
+
+    def onInit(self):
+        super(SoakTROff, self).onInit()
+        self.__random.seed(self.__options.soak_seed)
+        self.__num_cycles = max(
+            int(self.__options.soak_hours * 3600 * FAKE_FPS / (MATCH_FRAMES + IDLE_FRAMES)), WARMUP_CYCLES + 3
+        )
+        self.__controllers = [node for node in walk_nodes(self) if isinstance(node, Controller)]
+        self.__schedule_cycle()
+        player.subscribe(player.ON_FRAME, self.__on_frame)
+
+    def __schedule_cycle(self):
+        # one cycle: let everybody join and start a match, turn randomly until the match is over,
+        # then wait for the idle demo and stop it
+        center = player.getRootNode().size / 2
+        frame = self.__frame + 1
+        for ctrl in self.__controllers:
+            self.__tap(frame, ctrl.getAbsPos(ctrl.size / 2))
+        # the center taps clear the wins after a final match or start the match
+        self.__tap(frame + 10, center)
+        self.__tap(frame + 20, center)
+        for ctrl in self.__controllers:
+            self.__tap(frame + 30, ctrl.getAbsPos(ctrl.size / 2))
+        self.__tap(frame + 40, center)
+        turn_frame = frame + 60
+        while turn_frame < frame + MATCH_FRAMES:
+            ctrl = self.__random.choice(self.__controllers)
+            w, h = ctrl.size
+            local_pos = (w * 0.75, h * 0.25) if self.__random.random() < 0.5 else (w * 0.25, h * 0.75)
+            self.__tap(turn_frame, ctrl.getAbsPos(Point2D(local_pos)))
+            turn_frame += self.__random.randint(5, 30)
+        self.__tap(frame + MATCH_FRAMES + IDLE_FRAMES - 2, center)
+
+    def __tap(self, frame, pos):
+        cursor_id = self.__next_cursor_id
+        self.__next_cursor_id += 1
+        self.__events.setdefault(frame, []).append((cursor_id, avg.Event.CURSOR_DOWN, pos))
+        self.__events.setdefault(frame + 1, []).append((cursor_id, avg.Event.CURSOR_UP, pos))
+
+    def __on_frame(self):
+        helper = player.getTestHelper()
+        for cursor_id, type_, pos in self.__events.pop(self.__frame, []):
+            helper.fakeTouchEvent(cursor_id, type_, avg.Event.TOUCH, pos)
+        self.__frame += 1
+        if self.__frame % (MATCH_FRAMES + IDLE_FRAMES) == 0:
+            self.__sample()
+            if len(self.samples) >= self.__num_cycles:
+                player.stop()
+            else:
+                self.__schedule_cycle()
+
+    def __sample(self):
+        gc.collect()
+        objects = {}
+        for obj in gc.get_objects():
+            name = type(obj).__name__
+            objects[name] = objects.get(name, 0) + 1
+
+        nodes = list(walk_nodes(player.getRootNode()))
+        subscriptions = player.getNumSubscribers(player.ON_FRAME)
+        for node in nodes:
+            for message in CURSOR_MESSAGES:
+                subscriptions += node.getNumSubscribers(message)
+
+        self.samples.append({
+            'nodes': len(nodes),
+            'subscriptions': subscriptions,
+            'timers': self.__player_proxy.num_timers,
+            'rss_kb': rss_kbytes(),
+            'objects': objects,
+        })
+
+
+def find_growth(series, tolerance):
+    # a value grows without bound if it never drops back to its early level
+    third = len(series) / 3
+    if third == 0:
+        return False
+    return min(series[-third:]) > max(series[:third]) + tolerance
+
+
+def report(samples):
+    samples = samples[WARMUP_CYCLES:]
+    if len(samples) < 3:
+        print 'not enough samples: %d' % len(samples)
+        return True
+
+    failed = False
+    print '%-40s %10s %10s %10s  %s' % ('value', 'first', 'last', 'max', '')
+    for key, tolerance in (('nodes', 0), ('subscriptions', 0), ('timers', 0), ('rss_kb', None)):
+        series = [sample[key] for sample in samples]
+        if tolerance is None:
+            tolerance = max(series[:len(series) / 3]) * (RSS_TOLERANCE - 1)
+        growing = find_growth(series, tolerance)
+        failed = failed or growing
+        print '%-40s %10d %10d %10d  %s' % (key, series[0], series[-1], max(series), 'GROWING' if growing else '')
+
+    names = set()
+    for sample in samples:
+        names.update(sample['objects'])
+    for name in sorted(names):
+        series = [sample['objects'].get(name, 0) for sample in samples]
+        if find_growth(series, OBJECT_TOLERANCE):
+            failed = True
+            print '%-40s %10d %10d %10d  %s' % (
+                'objects: ' + name, series[0], series[-1], max(series), 'GROWING'
+            )
+    return failed
+
+
+if __name__ == '__main__':
+    troff.player = PlayerProxy(player)
+    main_div = SoakTROff(troff.player)
+    app.App().run(main_div, app_resolution='640x360', app_fullscreen='false')
+    sys.exit(1 if report(main_div.samples) else 0)
@@ -0,0 +1,371 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Live state stream for TROff - A Multitouch TRON Clone
+#
+# Copyright (C) 2011-2020 Thomas Schott, <scotty at c-base dot org>
+#
+# TROff is free software: You can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# TROff is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with TROff. If not, see <http://www.gnu.org/licenses/>.
+
+# Publishes the arena state per game tick on a local (unix domain) socket, enabled by starting the
+# game with '--state-stream=PATH'. Running 'python statestream.py PATH' connects a reference consumer
+# that prints the standings and a mini-map.
+#
+# Every message is a uint32 payload length followed by the payload: the uint32 tick number and a
+# sequence of records, each a type character and its data (little endian, positions in grid units):
+#   'R' trail_length:H           new round, all trails are cleared, trails are cut to trail_length
+#                                grid steps behind the heads (0: unlimited)
+#   'J' player:B x:h y:h         player joined, its trail starts at (x, y)
+#   'T' player:B x:h y:h         player turned at (x, y), a new trail segment starts there
+#   'H' player:B x:h y:h         player head moved to (x, y)
+#   'C' player:B                 player crashed
+#   'W' player:B count:B         player win count changed
+#   'P' player:b                 shield owner changed (-1: nobody)
+#   'K' width:H height:H trail_length:H num_players:B,
+#       per player: alive:B wins:B num_points:H points:(x:h y:h)* head:(x:h y:h),
+#       shield owner:b           full snapshot, replaces the whole state
+# A client gets a snapshot when it connects and deltas afterwards. Clients are never waited for:
+# if a client falls behind by more than CLIENT_BACKLOG bytes of deltas (a pending snapshot doesn't
+# count), its pending deltas are dropped and it is resynced with a snapshot.
+
+import errno
+import os
+import socket
+import stat
+import struct
+import sys
+
+
+CLIENT_BACKLOG = 64 * 1024
+MESSAGE_HEADER = struct.Struct('<II')
+RECORD_POS = struct.Struct('<Bhh')
+RECORD_PLAYER = struct.Struct('<B')
+RECORD_WINS = struct.Struct('<BB')
+RECORD_SHIELD = struct.Struct('<b')
+RECORD_ROUND = struct.Struct('<H')
+SNAPSHOT_HEADER = struct.Struct('<HHHB')
+SNAPSHOT_PLAYER = struct.Struct('<BBH')
+POINT = struct.Struct('<hh')
+SOCKET_ERRORS = (errno.EPIPE, errno.ECONNRESET, errno.ENOTCONN)
+
+
+class ArenaState(object):
+    def __init__(self, size=(0, 0), num_players=0, trail_length=0):
+        self.size = size
+        self.trail_length = trail_length
+        self.tick = 0
+        self.alive = [False] * num_players
+        self.wins = [0] * num_players
+        self.points = [[] for i in xrange(num_players)]  # trail start and turn points
+        self.heads = [None] * num_players
+        self.shield_owner = -1
+
+    def snapshot(self):
+        data = [SNAPSHOT_HEADER.pack(self.size[0], self.size[1], self.trail_length, len(self.alive))]
+        for alive, wins, points, head in zip(self.alive, self.wins, self.points, self.heads):
+            data.append(SNAPSHOT_PLAYER.pack(alive, wins, len(points)))
+            data.extend(POINT.pack(*point) for point in points)
+            data.append(POINT.pack(*(head or (0, 0))))
+        data.append(RECORD_SHIELD.pack(self.shield_owner))
+        return 'K' + ''.join(data)
+
+    def apply(self, tick, payload):
+        self.tick = tick
+        pos = 0
+        while pos < len(payload):
+            type_ = payload[pos]
+            pos += 1
+            if type_ in 'JTH':
+                idx, x, y = RECORD_POS.unpack_from(payload, pos)
+                pos += RECORD_POS.size
+                if type_ == 'J':
+                    self.alive[idx] = True
+                    self.points[idx] = [(x, y)]
+                elif type_ == 'T':
+                    self.points[idx].append((x, y))
+                self.heads[idx] = (x, y)
+                if type_ == 'H':
+                    self.trim(idx)
+            elif type_ == 'C':
+                idx, = RECORD_PLAYER.unpack_from(payload, pos)
+                pos += RECORD_PLAYER.size
+                self.alive[idx] = False
+            elif type_ == 'W':
+                idx, count = RECORD_WINS.unpack_from(payload, pos)
+                pos += RECORD_WINS.size
+                self.wins[idx] = count
+            elif type_ == 'P':
+                self.shield_owner, = RECORD_SHIELD.unpack_from(payload, pos)
+                pos += RECORD_SHIELD.size
+            elif type_ == 'R':
+                self.trail_length, = RECORD_ROUND.unpack_from(payload, pos)
+                pos += RECORD_ROUND.size
+                self.alive = [False] * len(self.alive)
+                self.points = [[] for i in xrange(len(self.alive))]
+                self.heads = [None] * len(self.alive)
+            elif type_ == 'K':
+                width, height, trail_length, num_players = SNAPSHOT_HEADER.unpack_from(payload, pos)
+                pos += SNAPSHOT_HEADER.size
+                self.__init__((width, height), num_players, trail_length)
+                self.tick = tick
+                for idx in xrange(num_players):
+                    alive, self.wins[idx], num_points = SNAPSHOT_PLAYER.unpack_from(payload, pos)
+                    self.alive[idx] = bool(alive)
+                    pos += SNAPSHOT_PLAYER.size
+                    for i in xrange(num_points + 1):
+                        self.points[idx].append(POINT.unpack_from(payload, pos))
+                        pos += POINT.size
+                    head = self.points[idx].pop()
+                    self.heads[idx] = head if num_points else None
+                self.shield_owner, = RECORD_SHIELD.unpack_from(payload, pos)
+                pos += RECORD_SHIELD.size
+            else:
+                raise ValueError('invalid record type: %r' % type_)
+
+    def trim(self, idx):
+        # cut the trail trail_length grid steps behind the head
+        if not self.trail_length or self.heads[idx] is None:
+            return
+        points = self.points[idx]
+        remaining = self.trail_length
+        x, y = self.heads[idx]
+        for i in xrange(len(points) - 1, -1, -1):
+            px, py = points[i]
+            dist = abs(px - x) + abs(py - y)
+            if dist >= remaining:
+                points[i] = (x + cmp(px, x) * remaining, y + cmp(py, y) * remaining)
+                del points[:i]
+                return
+            remaining -= dist
+            x, y = px, py
+
+
+class _Client(object):
+    def __init__(self, sock):
+        self.sock = sock
+        self.messages = []
+        self.offset = 0  # of the first (partially sent) message
+        self.backlog = 0
+        self.snapshot = None  # the pending snapshot message
+        self.needs_snapshot = True
+
+
+class StateStream(object):
+    def __init__(self, path, size, num_players, trail_length=0):
+        self.__path = path
+        self.__state = ArenaState(size, num_players, trail_length)
+        self.__segments = [0] * num_players
+        self.__clients = []
+
+        if os.path.exists(path):
+            if not is_socket(path):
+                raise ValueError('%s exists and is not a socket' % path)
+            os.unlink(path)  # left over from an earlier run
+        self.__sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.__sock.setblocking(False)
+        self.__sock.bind(path)
+        self.__sock.listen(4)
+
+    def close(self):
+        for client in self.__clients:
+            client.sock.close()
+        self.__clients = []
+        self.__sock.close()
+        os.unlink(self.__path)
+
+    def publish(self, tick, players, shield_owner, turns=None, new_round=False):
+        # players: [(alive, (x, y) start, (x, y) head, number of trail segments created, wins)],
+        # turns: per player the (x, y) turn positions since the last tick, if several ticks passed,
+        # positions in grid units; new_round: the first tick published in a round
+        state = self.__state
+        state.tick = tick
+        records = []
+        if new_round:
+            record = 'R' + RECORD_ROUND.pack(state.trail_length)
+            records.append(record)
+            state.apply(tick, record)
+            self.__segments = [0] * len(players)
+        for idx, (alive, start, head, num_segments, wins) in enumerate(players):
+            if alive and not state.alive[idx]:
+                records.append('J' + RECORD_POS.pack(idx, *start))
+                state.alive[idx] = True
+                state.points[idx] = [start]
+                state.heads[idx] = start
+                self.__segments[idx] = 1
+            if state.alive[idx]:
+                if turns is not None:
+                    turn_positions = turns[idx]
+                else:
+                    # all turns since the last tick happened at the last head position
+                    turn_positions = [state.heads[idx]] * (num_segments - self.__segments[idx])
+                for pos in turn_positions:
+                    records.append('T' + RECORD_POS.pack(idx, *pos))
+                    state.points[idx].append(pos)
+                self.__segments[idx] = num_segments
+                if head != state.heads[idx]:
+                    records.append('H' + RECORD_POS.pack(idx, *head))
+                    state.heads[idx] = head
+                    state.trim(idx)
+                if not alive:
+                    records.append('C' + RECORD_PLAYER.pack(idx))
+                    state.alive[idx] = False
+            if wins != state.wins[idx]:
+                records.append('W' + RECORD_WINS.pack(idx, wins))
+                state.wins[idx] = wins
+        if shield_owner != state.shield_owner:
+            records.append('P' + RECORD_SHIELD.pack(shield_owner))
+            state.shield_owner = shield_owner
+        self.__flush(''.join(records))
+
+    def publish_wins(self, wins):
+        # between ticks (e.g. while no round is running): publishes win count changes, accepts new
+        # clients and sends pending data
+        state = self.__state
+        records = []
+        for idx, count in enumerate(wins):
+            if count != state.wins[idx]:
+                records.append('W' + RECORD_WINS.pack(idx, count))
+                state.wins[idx] = count
+        self.__flush(''.join(records) if records else None)
+
+    def __flush(self, payload):
+        # payload: the records of the current tick, None if there is nothing to send
+        self.__accept()
+        if not self.__clients:
+            return
+        tick = self.__state.tick
+        delta = self.__message(tick, payload) if payload is not None else None
+        snapshot = None
+        for client in self.__clients[:]:
+            if client.needs_snapshot:
+                if snapshot is None:
+                    snapshot = self.__message(tick, self.__state.snapshot())
+                self.__queue(client, snapshot, True)
+                client.needs_snapshot = False
+            elif delta is not None:
+                self.__queue(client, delta)
+            self.__send(client)
+
+    @staticmethod
+    def __message(tick, payload):
+        return MESSAGE_HEADER.pack(len(payload) + 4, tick) + payload
+
+    def __accept(self):
+        while True:
+            try:
+                sock, address = self.__sock.accept()
+            except socket.error as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return
+                raise
+            sock.setblocking(False)
+            self.__clients.append(_Client(sock))
+
+    @staticmethod
+    def __queue(client, message, snapshot=False):
+        client.messages.append(message)
+        client.backlog += len(message)
+        if snapshot:
+            client.snapshot = message
+            return
+        if client.backlog > CLIENT_BACKLOG + (len(client.snapshot) if client.snapshot is not None else 0):
+            # drop everything but a partially sent message and resync with the next snapshot
+            keep = client.messages[:1] if client.offset else []
+            client.messages = keep
+            client.backlog = sum(len(m) for m in keep) - client.offset
+            if not keep or keep[0] is not client.snapshot:
+                client.snapshot = None
+            client.needs_snapshot = True
+
+    def __send(self, client):
+        while client.messages:
+            data = client.messages[0][client.offset:]
+            try:
+                sent = client.sock.send(data)
+            except socket.error as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return
+                if e.errno in SOCKET_ERRORS:
+                    client.sock.close()
+                    self.__clients.remove(client)
+                    return
+                raise
+            client.backlog -= sent
+            if sent < len(data):
+                client.offset += sent
+                return
+            if client.messages.pop(0) is client.snapshot:
+                client.snapshot = None
+            client.offset = 0
+
+
+def is_socket(path):
+    return stat.S_ISSOCK(os.stat(path).st_mode)
+
+
+def read_messages(sock):
+    buf = ''
+    while True:
+        data = sock.recv(4096)
+        if not data:
+            return
+        buf += data
+        while len(buf) >= 4:
+            length, = struct.unpack_from('<I', buf)
+            if len(buf) < length + 4:
+                break
+            tick, = struct.unpack_from('<I', buf, 4)
+            yield tick, buf[8:length + 4]
+            buf = buf[length + 4:]
+
+
+def print_state(state, map_size=(64, 18)):
+    def plot(x, y, char):
+        col = min(max(x * map_size[0] / max(state.size[0], 1), 0), map_size[0] - 1)
+        row = min(max(y * map_size[1] / max(state.size[1], 1), 0), map_size[1] - 1)
+        rows[row][col] = char
+
+    rows = [[' '] * map_size[0] for i in xrange(map_size[1])]
+    for idx, points in enumerate(state.points):
+        if state.heads[idx] is None:
+            continue
+        trail_char = 'abcdefgh'[idx % 8] if state.alive[idx] else '.'
+        for (x1, y1), (x2, y2) in zip(points, points[1:] + [state.heads[idx]]):
+            for i in xrange(max(abs(x2 - x1), abs(y2 - y1)) + 1):
+                plot(x1 + cmp(x2, x1) * i, y1 + cmp(y2, y1) * i, trail_char)
+        plot(state.heads[idx][0], state.heads[idx][1], str(idx + 1) if state.alive[idx] else 'x')
+
+    print '\x1b[H\x1b[2J',
+    print 'tick %6d   ' % state.tick + '   '.join(
+        'P%d: %d wins%s%s' % (idx + 1, wins, '' if state.alive[idx] else ' (out)',
+                              ' [shield]' if state.shield_owner == idx else '')
+        for idx, wins in enumerate(state.wins)
+    )
+    print '+' + '-' * map_size[0] + '+'
+    for row in rows:
+        print '|' + ''.join(row) + '|'
+    print '+' + '-' * map_size[0] + '+'
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        sys.stderr.write('usage: %s SOCKET_PATH\n' % sys.argv[0])
+        sys.exit(2)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(sys.argv[1])
+    state = ArenaState()
+    for tick, payload in read_messages(sock):
+        state.apply(tick, payload)
+        if tick % 10 == 0:
+            print_state(state)
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Territory overlay for TROff - A Multitouch TRON Clone
+#
+# Copyright (C) 2011-2020 Thomas Schott, <scotty at c-base dot org>
+#
+# TROff is free software: You can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# TROff is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with TROff. If not, see <http://www.gnu.org/licenses/>.
+
+# Assigns every free grid position to the player whose head can reach it first. Nothing is
+# recomputed from scratch per tick: the filled head positions are cleared right away, a multi-source
+# BFS bounded to NEAR_DEPTH steps relabels the area around the heads, where ownership changes most,
+# and the rest of the grid is relabeled by a multi-source BFS that advances by FAR_BUDGET positions
+# per tick. The owners are kept as B8G8R8A8 pixels, one per grid position.
+#
+# The near-field BFS marks the positions it has seen with the tick's generation number, so its seen
+# array is only cleared when the generation wraps around.
+
+import re
+from collections import deque
+
+
+NO_OWNER = 255
+NO_OWNER_BYTE = chr(NO_OWNER)
+EMPTY_PIXEL = '\0\0\0\0'
+UNSEEN_RUN = re.compile('\0+')
+NEAR_DEPTH = 12
+FAR_BUDGET = 3000
+
+
+class Territory(object):
+    def __init__(self, grid_size, cell_size, colors, trail_cells, wall_cells=None):
+        # colors: B8G8R8A8 pixel per player, trail_cells/wall_cells: non-zero for blocked positions
+        self.__width = int(grid_size[0]) + 1
+        self.__height = int(grid_size[1]) + 1
+        self.__num_cells = self.__width * self.__height
+        self.__cell_size = cell_size
+        self.__colors = colors
+        self.__trail_cells = trail_cells
+
+        # walls and border
+        self.__static_cells = bytearray(wall_cells) if wall_cells is not None else bytearray(self.__num_cells)
+        self.__static_cells[:self.__width] = '\1' * self.__width
+        self.__static_cells[-self.__width:] = '\1' * self.__width
+        for y in xrange(self.__height):
+            self.__static_cells[y * self.__width] = 1
+            self.__static_cells[y * self.__width + self.__width - 1] = 1
+
+        self.__owners = bytearray([NO_OWNER]) * self.__num_cells
+        self.__pixels = bytearray(4 * self.__num_cells)
+        self.__far_frontier = deque()
+        self.__far_seen = None
+        self.__near_seen = bytearray(self.__num_cells)
+        self.__near_generation = 0
+        self.__changed = True
+
+    @property
+    def size(self):
+        return self.__width, self.__height
+
+    @property
+    def pixels(self):
+        return self.__pixels
+
+    @property
+    def changed(self):
+        # whether the last update changed any pixels
+        return self.__changed
+
+    def reset(self):
+        self.__owners = bytearray([NO_OWNER]) * self.__num_cells
+        self.__pixels = bytearray(4 * self.__num_cells)
+        self.__far_frontier = deque()
+        self.__far_seen = None
+        self.__changed = True
+
+    def update(self, heads):
+        # heads: [(player index, pos)] of the active players
+        self.__changed = False
+        sources = []
+        for idx, pos in heads:
+            x, y = int(round(pos.x / self.__cell_size)), int(round(pos.y / self.__cell_size))
+            if 0 < x < self.__width - 1 and 0 < y < self.__height - 1:
+                cell = y * self.__width + x
+                self.__set_owner(cell, NO_OWNER)  # newly filled
+                sources.append((cell, idx))
+
+        if not self.__far_frontier:
+            self.__finish_far_pass()
+            self.__far_frontier.extend(sources)
+            self.__far_seen = bytearray(self.__num_cells)
+            for cell, idx in sources:
+                self.__far_seen[cell] = 1
+        self.__expand(self.__far_frontier, self.__far_seen, 1, FAR_BUDGET, None)
+
+        if self.__near_generation == 255:
+            self.__near_seen = bytearray(self.__num_cells)
+            self.__near_generation = 0
+        self.__near_generation += 1
+        for cell, idx in sources:
+            self.__near_seen[cell] = self.__near_generation
+        self.__expand(deque(sources), self.__near_seen, self.__near_generation, None, NEAR_DEPTH)
+
+    def __expand(self, frontier, seen, mark, budget, max_depth):
+        # breadth first from the frontier, the first player to reach a position owns it
+        width = self.__width
+        trail_cells = self.__trail_cells
+        static_cells = self.__static_cells
+        owners = self.__owners
+        pixels = self.__pixels
+        colors = self.__colors
+        depth_left = max_depth
+        level_end = len(frontier)
+        changed = False
+        while frontier:
+            if budget is not None:
+                if budget == 0:
+                    break
+                budget -= 1
+            if max_depth is not None:
+                if level_end == 0:
+                    depth_left -= 1
+                    level_end = len(frontier)
+                if depth_left == 0:
+                    break
+                level_end -= 1
+            cell, idx = frontier.popleft()
+            for neighbor in (cell - 1, cell + 1, cell - width, cell + width):
+                if seen[neighbor] == mark:
+                    continue
+                seen[neighbor] = mark
+                if trail_cells[neighbor] or static_cells[neighbor]:
+                    owner = NO_OWNER
+                else:
+                    owner = idx
+                    frontier.append((neighbor, idx))
+                if owners[neighbor] != owner:
+                    owners[neighbor] = owner
+                    pixels[neighbor * 4:neighbor * 4 + 4] = EMPTY_PIXEL if owner == NO_OWNER else colors[owner]
+                    changed = True
+        if changed:
+            self.__changed = True
+
+    def __finish_far_pass(self):
+        # positions no head could reach belong to nobody
+        if self.__far_seen is None:
+            return
+        for run in UNSEEN_RUN.finditer(self.__far_seen):
+            start, end = run.span()
+            if self.__owners.count(NO_OWNER_BYTE, start, end) != end - start:
+                self.__owners[start:end] = NO_OWNER_BYTE * (end - start)
+                self.__pixels[start * 4:end * 4] = EMPTY_PIXEL * (end - start)
+                self.__changed = True
+
+    def __set_owner(self, cell, idx):
+        if self.__owners[cell] != idx:
+            self.__owners[cell] = idx
+            self.__pixels[cell * 4:cell * 4 + 4] = EMPTY_PIXEL if idx == NO_OWNER else self.__colors[idx]
+            self.__changed = True
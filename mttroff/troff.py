@@ -18,17 +18,31 @@
 # You should have received a copy of the GNU General Public License
 # along with TROff. If not, see <http://www.gnu.org/licenses/>.
 
-from libavg import avg, Point2D, player, app, utils
-from libavg.utils import getMediaDir
+from libavg import avg, Point2D, player, app
+from collections import deque
+from contextlib import closing
+from itertools import islice
 from math import floor, ceil, pi
+from os.path import dirname, abspath, exists, isfile
 from random import choice, randint
 from cPickle import load
 
+from arenamap import load_map, WallGrid, TrailGrid
+from assets import Assets
+from statestream import StateStream, is_socket
+from territory import Territory
+from rewind import PlayerSnapshot, GameSnapshot, push_line, trail_lines
+from simulation import SimulationProcess, ITEM_SHIELD, ITEM_BLOCKER
+
 
 BASE_GRID_SIZE = Point2D(320, 180)
 BASE_BORDER_WIDTH = 10
 IDLE_TIMEOUT = 10000
 PLAYER_COLORS = ['00FF00', 'FF00FF', '00FFFF', 'FFFF00']
+WALL_COLOR = 'B00000'  # same color as the border
+WALL_PIXEL = '\x00\x00\xb0\xff'  # WALL_COLOR as B8G8R8A8
+FOLLOW_SPEED = 0.1
+TERRITORY_OPACITY = 0.25
 
 g_grid_size = 4
 
@@ -57,6 +71,16 @@ class Button(object):
                 ]
             )
             self.__node = avg.PolygonNode(pos=pos)
+        elif icon == 'r':  # 'rewind' button
+            scale = g_grid_size * 4
+            x_offset = parent.width / 2
+            y_offset = parent.height / 8
+            pos = map(
+                lambda (x, y): (x * scale + x_offset, y * scale + y_offset), [
+                    (-2, 0), (0, -1.5), (0, -0.3), (2, -1.5), (2, 1.5), (0, 0.3), (0, 1.5)
+                ]
+            )
+            self.__node = avg.PolygonNode(pos=pos)
         else:
             if icon == 'O':  # 'start' button
                 self.__node = avg.CircleNode(pos=parent.size / 2, r=h / 4, strokewidth=2)
@@ -121,6 +145,10 @@ class Controller(avg.DivNode):
         self.__player_joined = False
         self.__player.register_controller(self)
 
+    @property
+    def player(self):
+        return self.__player
+
     def pre_start(self, clear_wins):
         self.__join_button.activate()
         self.sensitive = True
@@ -197,6 +225,62 @@ class WinCounter(avg.DivNode):
         self.__count = 0
 
 
+class TrailSegment(object):
+    # stands in for a trail LineNode in scrolling arenas, the node only exists while it is in view
+    __slots__ = ('__viewport', '__parent', '__color', '__pos1', '__pos2', '__node')
+
+    def __init__(self, viewport, parent, pos1, pos2, color):
+        self.__viewport = viewport
+        self.__parent = parent
+        self.__color = color
+        self.__pos1 = Point2D(pos1)
+        self.__pos2 = Point2D(pos2)
+        self.__node = None
+        viewport.add(self)
+
+    @property
+    def pos1(self):
+        return self.__pos1
+
+    @pos1.setter
+    def pos1(self, pos):
+        self.__pos1 = Point2D(pos)
+        if self.__node is not None:
+            self.__node.pos1 = pos
+        self.__viewport.update(self)
+
+    @property
+    def pos2(self):
+        return self.__pos2
+
+    @pos2.setter
+    def pos2(self, pos):
+        self.__pos2 = Point2D(pos)
+        if self.__node is not None:
+            self.__node.pos2 = pos
+        self.__viewport.update(self)
+
+    @property
+    def bounds(self):
+        return (min(self.__pos1.x, self.__pos2.x), min(self.__pos1.y, self.__pos2.y),
+                max(self.__pos1.x, self.__pos2.x), max(self.__pos1.y, self.__pos2.y))
+
+    def show(self):
+        if self.__node is None:
+            self.__node = avg.LineNode(
+                parent=self.__parent, pos1=self.__pos1, pos2=self.__pos2, color=self.__color, strokewidth=2
+            )
+
+    def hide(self):
+        if self.__node is not None:
+            self.__node.unlink(True)
+            self.__node = None
+
+    def unlink(self, kill=False):
+        self.hide()
+        self.__viewport.remove(self)
+
+
 class Player(avg.DivNode):
     def __init__(self, color, start_pos, start_heading, parent=None, **kwargs):
         kwargs['opacity'] = 0
@@ -207,7 +291,14 @@ class Player(avg.DivNode):
         self._color = color
         self.__start_pos = Point2D(start_pos)
         self.__start_heading = Point2D(start_heading)
-        self._lines = []
+        self._lines = deque()  # newest line first
+        self._trail_grid = None
+        self.__trail_length = 0
+        self.__trail = None  # visited positions, only kept with a trail grid
+        self.__num_segments = 0
+        self.__keep_finished_lines = False
+        self.__finished_lines = None  # shared with the snapshots, see rewind.py
+        self.__viewport = None
 
         self.__node = avg.DivNode(parent=self, pivot=(0, 0))
         self.__body = avg.CircleNode(parent=self.__node, color=self._color)
@@ -231,6 +322,39 @@ class Player(avg.DivNode):
     def _pos(self):
         return self.__node.pos
 
+    @property
+    def _start_pos(self):
+        return self.__start_pos
+
+    @property
+    def _start_heading(self):
+        return self.__start_heading
+
+    @property
+    def _num_segments(self):
+        return self.__num_segments
+
+    def _set_trail_grid(self, trail_grid, max_length=0):
+        # trail positions are tracked in trail_grid, with max_length the tail retracts as the head moves
+        self._trail_grid = trail_grid
+        self.__trail_length = max_length
+
+    def _set_viewport(self, viewport):
+        # trail lines are culled against the viewport
+        self.__viewport = viewport
+
+    def _enable_snapshots(self):
+        # the finished lines are only kept for the snapshots
+        self.__keep_finished_lines = True
+
+    def _snapshot(self, idx, crashed):
+        pos = self.__node.pos
+        return PlayerSnapshot(
+            idx, crashed, (pos.x, pos.y), (self.__heading.x, self.__heading.y), self.__line_tuple(self._lines[0]),
+            self.__finished_lines, len(self._lines) - 1,
+            self.__line_tuple(self._lines[-1]) if self.__trail_length and len(self._lines) > 1 else None
+        )
+
     def _set_ready(self):
         self.__node.pos = self.__start_pos
         self.__heading = Point2D(self.__start_heading)
@@ -239,10 +363,19 @@ class Player(avg.DivNode):
         self.__body.opacity = 1
         self.__node_anim.start()
         avg.Anim.fadeIn(self, 200)
+        self.__num_segments = 0
+        self.__finished_lines = None
         self.__create_line()
+        if self._trail_grid is not None:
+            self.__trail = deque([self.__node.pos])
+            self._trail_grid.mark(self.__node.pos)
 
     def _set_dead(self, explode):
         self.__node_anim.abort()
+        if self.__trail is not None:
+            for pos in self.__trail:
+                self._trail_grid.unmark(pos)
+            self.__trail = None
         if explode:
             self.__body.strokewidth = 3
             self.__explode_anim.start()
@@ -256,6 +389,27 @@ class Player(avg.DivNode):
             self._lines[0].pos1 = self.__node.pos
         else:
             self._lines[0].pos2 = self.__node.pos
+        if self.__trail is not None:
+            self.__trail.append(self.__node.pos)
+            self._trail_grid.mark(self.__node.pos)
+            if self.__trail_length and len(self.__trail) > self.__trail_length + 1:
+                self.__retract_tail()
+
+    def __retract_tail(self):
+        tail = self.__trail.popleft()
+        self._trail_grid.unmark(tail)
+        self.__drop_empty_lines()  # e.g. from a turn before the first step
+        line = self._lines[-1]
+        if line.pos1 == tail:
+            line.pos1 = self.__trail[0]
+        else:
+            line.pos2 = self.__trail[0]
+        self.__drop_empty_lines()
+
+    def __drop_empty_lines(self):
+        # drop the oldest lines without length (run past by the tail), but never the current one
+        while len(self._lines) > 1 and self._lines[-1].pos1 == self._lines[-1].pos2:
+            self._lines.pop().unlink()
 
     def _change_heading(self, heading):
         if self.__heading.x == 0:
@@ -264,19 +418,46 @@ class Player(avg.DivNode):
         else:
             self.__heading.y = -heading * self.__heading.x
             self.__heading.x = 0
+        if self.__keep_finished_lines:
+            self.__finished_lines = push_line(self.__finished_lines, self.__line_tuple(self._lines[0]))
         self.__create_line()
 
+    def _move_to(self, turns, pos):
+        # replays the turns made by the simulation process since the last frame, then moves the head
+        for turn in turns:
+            self.__move_head(turn)
+            self.__create_line()
+        self.__move_head(pos)
+
+    def __move_head(self, pos):
+        self.__node.pos = pos
+        if pos.x < self.__line_start.x or pos.y < self.__line_start.y:
+            self._lines[0].pos1 = pos
+        else:
+            self._lines[0].pos2 = pos
+
     def __create_line(self):
-        self._lines.insert(0, avg.LineNode(
-            parent=self, pos1=self.__node.pos, pos2=self.__node.pos,
-            color=self._color, strokewidth=2
-        ))
+        self.__line_start = self.__node.pos
+        if self.__viewport is not None:
+            self._lines.appendleft(TrailSegment(
+                self.__viewport, self, self.__node.pos, self.__node.pos, self._color
+            ))
+        else:
+            self._lines.appendleft(avg.LineNode(
+                parent=self, pos1=self.__node.pos, pos2=self.__node.pos,
+                color=self._color, strokewidth=2
+            ))
+        self.__num_segments += 1
+
+    @staticmethod
+    def __line_tuple(line):
+        return (line.pos1.x, line.pos1.y), (line.pos2.x, line.pos2.y)
 
     def __remove(self):
         def remove_lines():
             for line in self._lines:
                 line.unlink()
-            self._lines = []
+            self._lines = deque()
 
         avg.Anim.fadeOut(self, 200, remove_lines)
 
@@ -297,6 +478,8 @@ class RealPlayer(Player):
 
         self.__controller = None
         self.__shield = None
+        self.__simulation = None
+        self.__idx = None
 
     @property
     def color(self):
@@ -310,6 +493,43 @@ class RealPlayer(Player):
     def wins(self):
         return self.__wins.count
 
+    @property
+    def pos(self):
+        return self._pos
+
+    @property
+    def start_pos(self):
+        return self._start_pos
+
+    @property
+    def start_heading(self):
+        return self._start_heading
+
+    @property
+    def has_shield(self):
+        return self.__shield is not None
+
+    @property
+    def num_segments(self):
+        return self._num_segments
+
+    def set_trail_grid(self, trail_grid, max_length=0):
+        super(RealPlayer, self)._set_trail_grid(trail_grid, max_length)
+
+    def set_viewport(self, viewport):
+        super(RealPlayer, self)._set_viewport(viewport)
+
+    def enable_snapshots(self):
+        super(RealPlayer, self)._enable_snapshots()
+
+    def set_simulation(self, simulation, idx):
+        # turns go to the simulation process, the player only renders its state
+        self.__simulation = simulation
+        self.__idx = idx
+
+    def snapshot(self, idx, crashed=False):
+        return super(RealPlayer, self)._snapshot(idx, crashed)
+
     def register_controller(self, controller):
         self.__controller = controller
 
@@ -332,37 +552,61 @@ class RealPlayer(Player):
             self.__shield.move(self._pos)
 
     def change_heading(self, heading):
-        super(RealPlayer, self)._change_heading(heading)
+        if self.__simulation is not None:
+            self.__simulation.turn(self.__idx, heading)
+        else:
+            super(RealPlayer, self)._change_heading(heading)
 
-    def check_crash(self, players, blocker):
+    def move_to(self, turns, pos):
+        super(RealPlayer, self)._move_to(turns, pos)
+        if self.__shield is not None:
+            self.__shield.move(self._pos)
+
+    def check_crash(self, players, blocker, walls):
         pos = self._pos
         # check border
         if pos.x == 0 or pos.y == 0 or pos.x == self.width or pos.y == self.height:
             return True
+        # check static walls
+        if walls is not None and walls.check_collision(pos):
+            return True
         # check blocker
         if blocker.check_collision(pos):
             return True
+        # check trail positions (counting the own head)
+        if self._trail_grid is not None:
+            if self._trail_grid.count(pos) > 1:
+                if self.__shield is None:
+                    return True
+                self.cross_shield()
+            return False
         # check lines
         for player_ in players:
             if player_ is self:
                 first_line = 1  # don't check own current line
             else:
                 first_line = 0
-            for line in player_.lines[first_line:]:
+            for line in islice(player_.lines, first_line, None):
                 if (pos.x == line.pos1.x and line.pos1.y <= pos.y <= line.pos2.y) \
                         or (pos.y == line.pos1.y and line.pos1.x <= pos.x <= line.pos2.x):
                     if self.__shield is None:
                         return True
-                    self.__cross_sound.play()
-                    self.__shield.jump()
-                    self.__shield = None
+                    self.cross_shield()
         return False
 
     def check_shield(self, shield):
         if shield.check_collision(self._pos):
-            self.__shield_sound.play()
-            self.__shield = shield
-            self.__shield.grab()
+            self.grab_shield(shield)
+
+    def grab_shield(self, shield):
+        self.__shield_sound.play()
+        self.__shield = shield
+        self.__shield.grab()
+
+    def cross_shield(self):
+        self.__cross_sound.play()
+        self.__shield.jump()
+        self.__shield = None
 
 
 class IdlePlayer(Player):
@@ -452,14 +696,17 @@ class AboutPlayer(avg.DivNode):
 
 
 class DragItem(avg.DivNode):
-    def __init__(self, icon_node, parent=None, **kwargs):
+    def __init__(self, icon_node, walls=None, area_size=None, parent=None, **kwargs):
+        # area_size: the area the item is placed in, the parent's size by default
         self._pos_offset = Point2D(g_grid_size * 8, g_grid_size * 8)
-        w, h = parent.size
+        w, h = area_size if area_size is not None else parent.size
         kwargs['size'] = self._pos_offset * 2
         super(DragItem, self).__init__(**kwargs)
         self.registerInstance(self, parent)
 
         self.__active = False
+        self.__walls = walls
+        self.__parent = parent
 
         self.__min_pos_x = int(-self._pos_offset.x) + g_grid_size
         self.__max_pos_x = int(w - self._pos_offset.x)
@@ -485,8 +732,33 @@ class DragItem(avg.DivNode):
     def deactivate(self):
         self.__active = False
 
+    @property
+    def bounds(self):
+        return self.pos.x, self.pos.y, self.pos.x + self.width, self.pos.y + self.height
+
+    @property
+    def is_dragged(self):
+        return self.__cursor_id is not None
+
+    def show(self):
+        if self.getParent() is None:
+            self.__parent.appendChild(self)
+
+    def hide(self):
+        if self.__cursor_id is None and self.getParent() is not None:
+            self.unlink()
+
     def jump(self):
-        self.pos = (choice(self.__pos_x), choice(self.__pos_y))
+        for i in xrange(100):
+            self.pos = (choice(self.__pos_x), choice(self.__pos_y))
+            if self.__walls is None or not self.__walls.check_collision(self.pos + self._pos_offset):
+                return
+        # mostly walls, take the first free position
+        for y in self.__pos_y:
+            for x in self.__pos_x:
+                if not self.__walls.check_collision(Point2D(x, y) + self._pos_offset):
+                    self.pos = (x, y)
+                    return
 
     def check_collision(self, pos):
         if self.__cursor_id is not None:
@@ -506,7 +778,7 @@ class DragItem(avg.DivNode):
             return
         self.__cursor_id = event.cursorid
         self.setEventCapture(self.__cursor_id)
-        self.__drag_offset = event.pos - self.pos
+        self.__drag_offset = self.__parent.getRelPos(event.pos) - self.pos
         return
 
     def __on_up(self, event):
@@ -519,7 +791,7 @@ class DragItem(avg.DivNode):
     def __on_motion(self, event):
         if self.__cursor_id != event.cursorid:
             return
-        pos = (event.pos - self.__drag_offset) / g_grid_size
+        pos = (self.__parent.getRelPos(event.pos) - self.__drag_offset) / g_grid_size
         pos = Point2D(round(pos.x), round(pos.y)) * g_grid_size
         if self.__min_pos_x <= pos.x < self.__max_pos_x and self.__min_pos_y <= pos.y < self.__max_pos_y:
             self.pos = pos
@@ -604,10 +876,270 @@ class BgAnim(avg.DivNode):
             self.pos += self.__heading
 
 
+class WallRect(object):
+    # static wall of a scrolling arena, only drawn while it is in view
+    def __init__(self, viewport, parent, rect):
+        x0, y0, x1, y1 = rect
+        self.__pos = Point2D(x0, y0) * g_grid_size - Point2D(g_grid_size, g_grid_size) / 2
+        self.__size = Point2D(x1 - x0, y1 - y0) * g_grid_size
+        self.__parent = parent
+        self.__node = None
+        viewport.add(self)
+
+    @property
+    def bounds(self):
+        return self.__pos.x, self.__pos.y, self.__pos.x + self.__size.x, self.__pos.y + self.__size.y
+
+    def show(self):
+        if self.__node is None:
+            self.__node = avg.RectNode(
+                pos=self.__pos, size=self.__size, opacity=0, fillcolor=WALL_COLOR, fillopacity=1
+            )
+            self.__parent.insertChild(self.__node, 0)
+
+    def hide(self):
+        if self.__node is not None:
+            self.__node.unlink(True)
+            self.__node = None
+
+
+class Viewport(object):
+    # scrolls the world div and keeps nodes only for the items (with bounds, show() and hide()) in view
+    def __init__(self, world_div, view_size):
+        self.__world_div = world_div
+        self.__view_size = Point2D(view_size)
+        self.__max_origin = world_div.size - self.__view_size
+        # items are culled against the view extended by the margin, so culling all items is only
+        # needed once the view leaves that area
+        self.__margin = self.__view_size / 4
+        self.__items = set()
+        self.__moving_items = []  # items that move on their own, checked on every view change
+        self.__layers = []
+        self.__culled = None
+        self.__cull()
+
+    def add_layer(self, div):
+        # div scrolls along with the world div
+        div.pos = self.__world_div.pos
+        self.__layers.append(div)
+
+    def add(self, item, moving=False):
+        self.__items.add(item)
+        if moving:
+            self.__moving_items.append(item)
+        self.update(item)
+
+    def remove(self, item):
+        self.__items.discard(item)
+
+    def update(self, item):
+        x0, y0, x1, y1 = item.bounds
+        cx0, cy0, cx1, cy1 = self.__culled
+        if x1 >= cx0 and x0 <= cx1 and y1 >= cy0 and y0 <= cy1:
+            item.show()
+        else:
+            item.hide()
+
+    def follow(self, positions, jump=False):
+        # move the view towards the center of the positions
+        if not positions:
+            return
+        center = Point2D(
+            (min(pos.x for pos in positions) + max(pos.x for pos in positions)) / 2,
+            (min(pos.y for pos in positions) + max(pos.y for pos in positions)) / 2
+        )
+        target = center - self.__view_size / 2
+        target = Point2D(
+            min(max(target.x, 0), self.__max_origin.x), min(max(target.y, 0), self.__max_origin.y)
+        )
+        origin = -self.__world_div.pos
+        if not jump:
+            target = origin + (target - origin) * FOLLOW_SPEED
+        origin = Point2D(round(target.x), round(target.y))
+        self.__world_div.pos = -origin
+        for layer in self.__layers:
+            layer.pos = -origin
+
+        cx0, cy0, cx1, cy1 = self.__culled
+        if origin.x < cx0 or origin.y < cy0 or origin.x + self.__view_size.x > cx1 \
+                or origin.y + self.__view_size.y > cy1:
+            self.__cull()
+        else:
+            for item in self.__moving_items:
+                self.update(item)
+
+    def __cull(self):
+        origin = -self.__world_div.pos
+        self.__culled = (
+            origin.x - self.__margin.x, origin.y - self.__margin.y,
+            origin.x + self.__view_size.x + self.__margin.x, origin.y + self.__view_size.y + self.__margin.y
+        )
+        for item in self.__items:
+            self.update(item)
+
+
+class RewindView(avg.DivNode):
+    # draws the buffered snapshots over the arena, dragging along the bar at the bottom scrubs through them
+    def __init__(self, snapshots, world_div, viewport, parent=None, **kwargs):
+        kwargs['size'] = parent.size
+        kwargs['opacity'] = 0
+        kwargs['sensitive'] = False
+        super(RewindView, self).__init__(**kwargs)
+        self.registerInstance(self, None)
+        parent.insertChild(self, 0)  # below the wins and buttons
+
+        self.__snapshots = snapshots
+        self.__world_div = world_div
+        self.__viewport = viewport
+        self.__is_shown = False
+
+        self.__arena = avg.DivNode(parent=self, sensitive=False)
+        self.__bar = avg.RectNode(
+            parent=self, pos=(g_grid_size * 48, self.height - g_grid_size * 10),
+            size=(self.width - g_grid_size * 96, g_grid_size * 6), color='FFFFFF', fillcolor='FFFFFF',
+            fillopacity=0.2
+        )
+        self.__marker = avg.RectNode(
+            parent=self, size=(g_grid_size, self.__bar.height + g_grid_size * 2), color='FFFFFF',
+            fillcolor='FFFFFF', fillopacity=1, sensitive=False
+        )
+
+        self.__cursor_id = None
+        self.__bar.subscribe(avg.Node.CURSOR_DOWN, self.__on_down)
+        self.__bar.subscribe(avg.Node.CURSOR_UP, self.__on_up)
+        self.__bar.subscribe(avg.Node.CURSOR_MOTION, self.__on_motion)
+
+    @property
+    def is_shown(self):
+        return self.__is_shown
+
+    def show(self):
+        if not self.__snapshots:
+            return
+        self.__is_shown = True
+        self.__show_snapshot(len(self.__snapshots) - 1)
+        avg.Anim.fadeIn(self, 200)
+        self.sensitive = True
+
+    def hide(self):
+        def clear():
+            while self.__arena.getNumChildren():
+                self.__arena.getChild(0).unlink(True)
+
+        if self.__cursor_id is not None:
+            self.__bar.releaseEventCapture(self.__cursor_id)
+            self.__cursor_id = None
+        self.__is_shown = False
+        self.sensitive = False
+        avg.Anim.fadeOut(self, 200, clear)
+
+    def __show_snapshot(self, idx):
+        snapshot = self.__snapshots[idx]
+        if self.__viewport is not None:
+            self.__viewport.follow([Point2D(player_.head) for player_ in snapshot.players], True)
+            self.__arena.pos = self.__world_div.pos
+
+        while self.__arena.getNumChildren():
+            self.__arena.getChild(0).unlink(True)
+        for player_ in snapshot.players:
+            color = PLAYER_COLORS[player_.idx]
+            for pos1, pos2 in trail_lines(player_):
+                avg.LineNode(parent=self.__arena, pos1=pos1, pos2=pos2, color=color, strokewidth=2)
+            if player_.crashed:
+                avg.CircleNode(parent=self.__arena, pos=player_.head, r=g_grid_size * 3, color=color, strokewidth=3)
+            else:
+                avg.CircleNode(parent=self.__arena, pos=player_.head, r=g_grid_size, color=color, fillcolor=color,
+                               fillopacity=1)
+        avg.CircleNode(parent=self.__arena, pos=snapshot.shield, r=g_grid_size * 2)
+        size = Point2D(g_grid_size * 3, g_grid_size * 3)
+        avg.RectNode(
+            parent=self.__arena, pos=Point2D(snapshot.blocker) - size / 2, size=size, color='FF0000',
+            fillcolor='FF0000', fillopacity=1
+        )
+
+        if len(self.__snapshots) > 1:
+            x = self.__bar.pos.x + self.__bar.width * idx / (len(self.__snapshots) - 1)
+        else:
+            x = self.__bar.pos.x + self.__bar.width
+        self.__marker.pos = (x - self.__marker.width / 2, self.__bar.pos.y - g_grid_size)
+
+    def __scrub(self, event):
+        x = (self.getRelPos(event.pos).x - self.__bar.pos.x) / self.__bar.width
+        self.__show_snapshot(int(round(min(max(x, 0), 1) * (len(self.__snapshots) - 1))))
+
+    def __on_down(self, event):
+        if self.__cursor_id is not None:
+            return
+        self.__cursor_id = event.cursorid
+        self.__bar.setEventCapture(self.__cursor_id)
+        self.__scrub(event)
+        return
+
+    def __on_up(self, event):
+        if self.__cursor_id != event.cursorid:
+            return
+        self.__bar.releaseEventCapture(self.__cursor_id)
+        self.__cursor_id = None
+        return
+
+    def __on_motion(self, event):
+        if self.__cursor_id != event.cursorid:
+            return
+        self.__scrub(event)
+        return
+
+
 class TROff(app.MainDiv):
+    def onArgvParserCreated(self, parser):
+        super(TROff, self).onArgvParserCreated(parser)
+        parser.add_option('--state-stream', default=None, metavar='PATH',
+                          help='publish the arena state on a unix domain socket')
+        parser.add_option('--map', default=None, metavar='NAME|PATH',
+                          help='arena map, one of data/maps/NAME.map or a map file')
+        parser.add_option('--snake', type='int', default=0, metavar='LENGTH',
+                          help='limit the trails to LENGTH grid steps, the tails retract as the heads move')
+        parser.add_option('--arena-scale', type='int', default=1, metavar='N',
+                          help='make the arena N times as large as the screen, the view follows the players')
+        parser.add_option('--territory', action='store_true', default=False,
+                          help='shade the arena by the player who can reach each position first')
+        parser.add_option('--rewind', type='int', default=0, metavar='TICKS',
+                          help='keep snapshots of the last TICKS game ticks, viewable between the rounds')
+        parser.add_option('--snapshot-interval', type='int', default=1, metavar='N',
+                          help='with --rewind, take a snapshot every N game ticks and on every crash')
+        parser.add_option('--simulation-rate', type='int', default=0, metavar='HZ',
+                          help='run the game rules in a separate process at HZ ticks per second')
+
+    def onArgvParsed(self, options, args, parser):
+        super(TROff, self).onArgvParsed(options, args, parser)
+        self.__state_stream_path = options.state_stream
+        self.__map_name = options.map
+        self.__trail_length = options.snake
+        self.__arena_scale = max(options.arena_scale, 1)
+        self.__show_territory = options.territory
+        self.__rewind_ticks = options.rewind
+        self.__snapshot_interval = max(options.snapshot_interval, 1)
+        self.__simulation_rate = options.simulation_rate
+        if self.__simulation_rate > 0 and (self.__trail_length > 0 or self.__show_territory or self.__rewind_ticks > 0):
+            parser.error('--simulation-rate cannot be combined with --snake, --territory or --rewind')
+        if self.__state_stream_path is not None and exists(self.__state_stream_path) \
+                and not is_socket(self.__state_stream_path):
+            parser.error('--state-stream: %s exists and is not a socket' % self.__state_stream_path)
+        self.__assets = Assets(dirname(abspath(__file__)))
+        if self.__map_name is not None and not isfile(self.__map_name) \
+                and not self.__assets.exists(self.__map_asset_name()):
+            parser.error('--map: no map file or bundled map named %s' % self.__map_name)
+        self.__map_rows = None
+        if self.__map_name is not None:
+            try:
+                self.__map_rows = self.__load_map()
+            except ValueError as e:
+                parser.error('--map: %s' % e)
+        self.__parser = parser  # the start positions can only be checked against the map in onInit
+
     def onInit(self):
         global g_grid_size
-        self.mediadir = utils.getMediaDir(__file__)
+        self.mediadir = self.__assets.mediadir
+        avg.WordsNode.addFontDir(self.__assets.fontdir)
         screen_size = player.getRootNode().size
         g_grid_size = int(min(floor(screen_size.x / BASE_GRID_SIZE.x), floor(screen_size.y / BASE_GRID_SIZE.y)))
         border_width = g_grid_size * BASE_BORDER_WIDTH
@@ -630,19 +1162,58 @@ class TROff(app.MainDiv):
         self.__init_idle_demo(battleground)
 
         self.__game_div = avg.DivNode(parent=battleground, size=battleground_size)
+        # the world div holds the trails; in scrolling arenas it lies below the controls
+        arena_size = battleground_size * self.__arena_scale
+        if self.__arena_scale > 1:
+            self.__world_div = avg.DivNode(parent=self.__game_div, size=arena_size)
+            self.__viewport = Viewport(self.__world_div, battleground_size)
+        else:
+            self.__world_div = self.__game_div
+            self.__viewport = None
+        if self.__show_territory:
+            # one pixel per grid position, below everything else in the arena
+            territory_size = arena_size + Point2D(g_grid_size, g_grid_size)
+            self.__territory_bitmap = avg.Bitmap(territory_size / g_grid_size, avg.B8G8R8A8, 'territory')
+            self.__territory_node = avg.ImageNode(
+                parent=self.__world_div, pos=(-g_grid_size / 2.0, -g_grid_size / 2.0), size=territory_size,
+                opacity=TERRITORY_OPACITY, sensitive=False
+            )
+        self.__walls = None
+        if self.__map_name is not None:
+            self.__walls = WallGrid(self.__map_rows, arena_size / g_grid_size, g_grid_size)
+            if self.__viewport is not None:
+                for rect in self.__walls.rects:
+                    WallRect(self.__viewport, self.__world_div, rect)
+            else:
+                walls_bitmap = avg.Bitmap(battleground_size, avg.B8G8R8A8, 'walls')
+                walls_bitmap.setPixels(self.__walls.render(battleground_size, WALL_PIXEL, '\0\0\0\0'))
+                avg.ImageNode(parent=self.__game_div, size=battleground_size).setBitmap(walls_bitmap)
         self.__ctrl_div = avg.DivNode(parent=self.__game_div, size=battleground_size)
         self.__wins_div = avg.DivNode(parent=self.__ctrl_div, size=battleground_size, opacity=0, sensitive=False)
 
-        self.__shield = Shield(parent=self.__ctrl_div)
-        self.__blocker = Blocker(parent=self.__ctrl_div)
+        if self.__viewport is not None:
+            # the items lie in world space above the controls, unsized, so that only the items catch touches
+            items_div = avg.DivNode(parent=self.__game_div)
+            self.__viewport.add_layer(items_div)
+        else:
+            items_div = self.__ctrl_div
+        self.__shield = Shield(walls=self.__walls, area_size=arena_size, parent=items_div)
+        self.__blocker = Blocker(walls=self.__walls, area_size=arena_size, parent=items_div)
+        if self.__viewport is not None:
+            self.__viewport.add(self.__shield, True)
+            self.__viewport.add(self.__blocker, True)
 
         ctrl_size = Point2D(g_grid_size * 42, g_grid_size * 42)
         player_pos = ctrl_size.x + g_grid_size * 2
+        # players start around the middle of the arena, in front of the controllers
+        start_offset = (arena_size - battleground_size) / 2 / g_grid_size
+        start_offset = Point2D(floor(start_offset.x), floor(start_offset.y)) * g_grid_size
+        self.__players = []
         self.__controllers = []
         # 1st
         player_ = RealPlayer(
-            PLAYER_COLORS[0], (player_pos, player_pos), (g_grid_size, 0),
-            self.__wins_div, ctrl_size, pi, parent=self.__game_div
+            PLAYER_COLORS[0], start_offset + Point2D(player_pos, player_pos), (g_grid_size, 0),
+            self.__wins_div, ctrl_size, pi, parent=self.__world_div
         )
         self.__controllers.append(Controller(
             player_, self.join_player, parent=self.__ctrl_div,
@@ -650,8 +1221,8 @@ class TROff(app.MainDiv):
         )
         # 2nd
         player_ = RealPlayer(
-            PLAYER_COLORS[1], (self.__ctrl_div.size.x - player_pos, player_pos), (-g_grid_size, 0),
-            self.__wins_div, ctrl_size, -pi / 2, parent=self.__game_div
+            PLAYER_COLORS[1], start_offset + Point2D(self.__ctrl_div.size.x - player_pos, player_pos),
+            (-g_grid_size, 0), self.__wins_div, ctrl_size, -pi / 2, parent=self.__world_div
         )
         self.__controllers.append(Controller(
             player_, self.join_player, parent=self.__ctrl_div,
@@ -659,8 +1230,8 @@ class TROff(app.MainDiv):
         )
         # 3rd
         player_ = RealPlayer(
-            PLAYER_COLORS[2], (player_pos, self.__ctrl_div.size.y - player_pos), (g_grid_size, 0),
-            self.__wins_div, ctrl_size, pi / 2, parent=self.__game_div
+            PLAYER_COLORS[2], start_offset + Point2D(player_pos, self.__ctrl_div.size.y - player_pos),
+            (g_grid_size, 0), self.__wins_div, ctrl_size, pi / 2, parent=self.__world_div
         )
         self.__controllers.append(Controller(
             player_, self.join_player, parent=self.__ctrl_div,
@@ -668,8 +1239,8 @@ class TROff(app.MainDiv):
         )
         # 4th
         player_ = RealPlayer(
-            PLAYER_COLORS[3], (self.__ctrl_div.size.x - player_pos, self.__ctrl_div.size.y - player_pos),
-            (-g_grid_size, 0), self.__wins_div, ctrl_size, 0, parent=self.__game_div
+            PLAYER_COLORS[3], start_offset + (self.__ctrl_div.size - Point2D(player_pos, player_pos)),
+            (-g_grid_size, 0), self.__wins_div, ctrl_size, 0, parent=self.__world_div
         )
         self.__controllers.append(Controller(
             player_, self.join_player, parent=self.__ctrl_div,
@@ -684,16 +1255,71 @@ class TROff(app.MainDiv):
             opacity=0, sensitive=False
         )
 
-        self.__left_quit_button = Button(self.__wins_div, 'FF0000', 'xl', player.stop)
+        self.__left_quit_button = Button(self.__wins_div, 'FF0000', 'xl', self._quit)
         self.__left_quit_button.activate()
-        self.__right_quit_button = Button(self.__wins_div, 'FF0000', 'xr', player.stop)
+        self.__right_quit_button = Button(self.__wins_div, 'FF0000', 'xr', self._quit)
         self.__right_quit_button.activate()
 
+        self.__snapshots = None
+        if self.__rewind_ticks > 0:
+            self.__snapshots = deque(maxlen=max(self.__rewind_ticks / self.__snapshot_interval, 1))
+            self.__rewind_view = RewindView(self.__snapshots, self.__world_div, self.__viewport, parent=self.__ctrl_div)
+            self.__rewind_button = Button(self.__wins_div, 'FFFFFF', 'r', self.__toggle_rewind)
+
         self.__red_sound = avg.SoundNode(parent=battleground, href='red.wav')
         self.__yellow_sound = avg.SoundNode(parent=battleground, href='yellow.wav')
         self.__green_sound = avg.SoundNode(parent=battleground, href='green.wav')
         self.__start_sound = avg.SoundNode(parent=battleground, href='start.wav')
 
+        for ctrl in self.__controllers:
+            self.__players.append(ctrl.player)
+        if self.__walls is not None:
+            for idx, player_ in enumerate(self.__players):
+                if self.__walls.check_collision(player_.start_pos) \
+                        or self.__walls.check_collision(player_.start_pos + player_.start_heading):
+                    self.__parser.error('--map: walls block the start position of player %d' % (idx + 1))
+        trail_grid = None
+        if self.__trail_length > 0 or self.__show_territory:
+            trail_grid = TrailGrid(arena_size / g_grid_size, g_grid_size)
+            for player_ in self.__players:
+                player_.set_trail_grid(trail_grid, self.__trail_length)
+        self.__territory = None
+        if self.__show_territory:
+            self.__territory = Territory(
+                arena_size / g_grid_size, g_grid_size,
+                [''.join(chr(int(color[i:i + 2], 16)) for i in (4, 2, 0)) + '\xff' for color in PLAYER_COLORS],
+                trail_grid.cells, self.__walls.cells if self.__walls is not None else None
+            )
+            self.__show_territory_pixels()
+        if self.__viewport is not None:
+            for player_ in self.__players:
+                player_.set_viewport(self.__viewport)
+        if self.__snapshots is not None:
+            for player_ in self.__players:
+                player_.enable_snapshots()
+
+        self.__simulation = None
+        self.__frame_handler = self.__on_game_frame
+        if self.__simulation_rate > 0:
+            self.__simulation = SimulationProcess(
+                self.__simulation_rate, arena_size / g_grid_size,
+                [(self.__grid_pos(player_.start_pos), self.__grid_pos(player_.start_heading))
+                 for player_ in self.__players],
+                self.__walls.cells if self.__walls is not None else None
+            )
+            for idx, player_ in enumerate(self.__players):
+                player_.set_simulation(self.__simulation, idx)
+            self.__frame_handler = self.__on_simulation_frame
+
+        self.__state_stream = None
+        if self.__state_stream_path is not None:
+            self.__state_stream = StateStream(
+                self.__state_stream_path, arena_size / g_grid_size, len(self.__players), self.__trail_length
+            )
+            player.subscribe(player.ON_FRAME, self.__on_stream_frame)
+        self.__tick = 0
+        self.__published_tick = None
+
         self.__down_handler_id = None
         self.__pre_start()
 
@@ -704,7 +1330,22 @@ class TROff(app.MainDiv):
 
         self.__start_idle_demo()
 
+    def onExit(self):
+        if self.__simulation is not None:
+            self.__simulation.close()
+            self.__simulation = None
+        if self.__state_stream is not None:
+            player.unsubscribe(player.ON_FRAME, self.__on_stream_frame)
+            self.__state_stream.close()
+            self.__state_stream = None
+        super(TROff, self).onExit()
+
+    def _quit(self):
+        player.stop()
+
     def join_player(self, player_):
+        if self.__snapshots is not None and self.__rewind_view.is_shown:
+            self.__rewind_view.hide()
         self.__active_players.append(player_)
         if len(self.__active_players) == 1:
             avg.Anim.fadeOut(self.__wins_div, 200)
@@ -726,7 +1367,12 @@ class TROff(app.MainDiv):
             avg.LinearAnim(self.__countdown_node, 'fillopacity', 1000, 1, 0).start()
             for ctrl_ in self.__controllers:
                 ctrl_.start()
-            player.subscribe(player.ON_FRAME, self.__on_game_frame)
+            self.__tick = 0
+            self.__published_tick = None
+            if self.__simulation is not None:
+                self.__simulation.start_round([self.__players.index(player_) for player_ in self.__active_players])
+                self.__sync_items()
+            player.subscribe(player.ON_FRAME, self.__frame_handler)
 
         def go_yellow():
             self.__yellow_sound.play()
@@ -744,12 +1390,22 @@ class TROff(app.MainDiv):
         self.__start_button.deactivate()
         for ctrl in self.__controllers:
             ctrl.deactivate_unjoined()
+        if self.__snapshots is not None:
+            self.__rewind_button.deactivate()
+            self.__snapshots.clear()
+        if self.__viewport is not None:
+            self.__viewport.follow([player_.start_pos for player_ in self.__active_players], True)
         go_red()
 
     def __stop(self, force_clear_wins=False):
         def restart():
             for player_ in self.__active_players:
                 player_.set_dead(False)
+            if self.__territory is not None:
+                self.__territory.reset()
+                self.__show_territory_pixels()
+            if self.__snapshots:
+                self.__rewind_button.activate()
             avg.Anim.fadeIn(self.__wins_div, 200)
             self.__wins_div.sensitive = True
             self.__activate_idle_timer()
@@ -758,7 +1414,7 @@ class TROff(app.MainDiv):
             else:
                 self.__pre_start()
 
-        player.unsubscribe(player.ON_FRAME, self.__on_game_frame)
+        player.unsubscribe(player.ON_FRAME, self.__frame_handler)
         self.__shield.deactivate()
         self.__blocker.deactivate()
         player.setTimeout(2000, restart)
@@ -771,15 +1427,88 @@ class TROff(app.MainDiv):
     def __on_game_frame(self):
         for player_ in self.__active_players:
             player_.step()
+        if self.__viewport is not None:
+            self.__viewport.follow([player_.pos for player_ in self.__active_players])
 
         crashed_players = []
         for player_ in self.__active_players:
-            if player_.check_crash(self.__active_players, self.__blocker):
+            if player_.check_crash(self.__active_players, self.__blocker, self.__walls):
                 crashed_players.append(player_)
+        if self.__snapshots is not None and (self.__tick % self.__snapshot_interval == 0 or crashed_players):
+            self.__take_snapshot(crashed_players)
         for player_ in crashed_players:
             player_.set_dead()
             self.__active_players.remove(player_)
 
+        if not self.__end_round():
+            for player_ in self.__active_players:
+                player_.check_shield(self.__shield)
+
+        if self.__territory is not None:
+            self.__territory.update(
+                [(idx, player_.pos) for idx, player_ in enumerate(self.__players) if player_ in self.__active_players]
+            )
+            if self.__territory.changed:
+                self.__show_territory_pixels()
+        if self.__state_stream is not None:
+            self.__publish_state()
+        self.__tick += 1
+
+    def __on_simulation_frame(self):
+        state = self.__simulation.read_state()
+        if state is None:
+            if not self.__simulation.is_alive:
+                self.__stop_simulation()
+            return  # the round hasn't started in the simulation process yet
+
+        shield_released = False
+        crashed_players = []
+        for player_ in self.__active_players:
+            player_state = state.players[self.__players.index(player_)]
+            player_.move_to(
+                [Point2D(pos) * g_grid_size for pos in player_state.turns], Point2D(player_state.head) * g_grid_size
+            )
+            for i in xrange(player_state.crossings):
+                if not player_.has_shield:
+                    player_.grab_shield(self.__shield)  # grabbed and used between two frames
+                player_.cross_shield()
+                shield_released = True
+            if not player_state.alive:
+                crashed_players.append(player_)
+        if self.__viewport is not None:
+            self.__viewport.follow([player_.pos for player_ in self.__active_players])
+        for player_ in crashed_players:
+            shield_released |= player_.has_shield
+            player_.set_dead()
+            self.__active_players.remove(player_)
+        if state.shield_released and not shield_released:
+            self.__shield.jump()  # grabbed by a player that crashed between two frames
+
+        if not self.__end_round():
+            if state.shield_owner != -1:
+                owner = self.__players[state.shield_owner]
+                if owner in self.__active_players and not owner.has_shield:
+                    owner.grab_shield(self.__shield)
+            self.__sync_items()
+
+        self.__tick = state.tick
+        if self.__state_stream is not None and self.__tick != self.__published_tick:
+            self.__publish_state([player_state.turns for player_state in state.players])
+
+    def __on_stream_frame(self):
+        # win counts also change between rounds and clients connect at any time
+        self.__state_stream.publish_wins([player_.wins for player_ in self.__players])
+
+    def __stop_simulation(self):
+        # the simulation process died: the round ends without a winner, the next ones run in this process
+        self.__stop()
+        self.__simulation.close()
+        self.__simulation = None
+        for idx, player_ in enumerate(self.__players):
+            player_.set_simulation(None, idx)
+        self.__frame_handler = self.__on_game_frame
+
+    def __end_round(self):
         if len(self.__active_players) == 0:
             self.__stop()
         elif len(self.__active_players) == 1:
@@ -789,20 +1518,84 @@ class TROff(app.MainDiv):
             else:
                 self.__stop()
         else:
-            for player_ in self.__active_players:
-                player_.check_shield(self.__shield)
+            return False
+        return True
+
+    def __sync_items(self):
+        # the simulation process gets shield and blocker positions as they change
+        if not any(player_.has_shield for player_ in self.__active_players):
+            self.__simulation.move_item(
+                ITEM_SHIELD, self.__grid_pos(self.__shield.pos + self.__shield.size / 2), self.__shield.is_dragged
+            )
+        self.__simulation.move_item(
+            ITEM_BLOCKER, self.__grid_pos(self.__blocker.pos + self.__blocker.size / 2), self.__blocker.is_dragged
+        )
+
+    @staticmethod
+    def __grid_pos(pos):
+        return int(round(pos.x / g_grid_size)), int(round(pos.y / g_grid_size))
+
+    def __publish_state(self, turns=None):
+        shield_owner = -1
+        players = []
+        for idx, player_ in enumerate(self.__players):
+            alive = player_ in self.__active_players
+            if alive and player_.has_shield:
+                shield_owner = idx
+            players.append((
+                alive, self.__grid_pos(player_.start_pos), self.__grid_pos(player_.pos), player_.num_segments,
+                player_.wins
+            ))
+        self.__state_stream.publish(self.__tick, players, shield_owner, turns, self.__published_tick is None)
+        self.__published_tick = self.__tick
+
+    def __take_snapshot(self, crashed_players):
+        shield_owner = -1
+        players = []
+        for idx, player_ in enumerate(self.__players):
+            if player_ in self.__active_players:
+                if player_.has_shield:
+                    shield_owner = idx
+                players.append(player_.snapshot(idx, player_ in crashed_players))
+        shield_pos = self.__shield.pos + self.__shield.size / 2
+        blocker_pos = self.__blocker.pos + self.__blocker.size / 2
+        self.__snapshots.append(GameSnapshot(
+            self.__tick, tuple(players), (shield_pos.x, shield_pos.y), shield_owner, (blocker_pos.x, blocker_pos.y),
+            tuple(player_.wins for player_ in self.__players)
+        ))
+
+    def __toggle_rewind(self):
+        if self.__rewind_view.is_shown:
+            self.__rewind_view.hide()
+        else:
+            self.__rewind_view.show()
+
+    def __show_territory_pixels(self):
+        self.__territory_bitmap.setPixels(str(self.__territory.pixels))
+        self.__territory_node.setBitmap(self.__territory_bitmap)
+
+    def __load_map(self):
+        if isfile(self.__map_name):
+            with open(self.__map_name, 'r') as fp:
+                return load_map(fp, self.__map_name)
+        name = self.__map_asset_name()
+        with closing(self.__assets.open(name)) as fp:
+            return load_map(fp, name)
+
+    def __map_asset_name(self):
+        return 'data/maps/%s.map' % self.__map_name
 
     def __init_idle_demo(self, parent):
         self.__idle_timeout_id = None
         self.__idle_players = []
 
-        with open(getMediaDir(__file__, 'data/idledemo.pickle'), 'r') as fp:
+        with closing(self.__assets.open('data/idledemo.pickle')) as fp:
             demo_data = load(fp)
         demo_div = avg.DivNode(parent=parent, pos=parent.size / 2 - Point2D(0, g_grid_size * 20))
         for data in demo_data:
             self.__idle_players.append(IdlePlayer(data, parent=demo_div))
 
-        with open(getMediaDir(__file__, 'data/idleabout.pickle'), 'r') as fp:
+        with closing(self.__assets.open('data/idleabout.pickle')) as fp:
             about_data = load(fp)
         about_div = avg.DivNode(parent=parent, pos=parent.size / 2 - Point2D(0, g_grid_size * 10))
         pos = Point2D(0, 0)
@@ -832,6 +1625,8 @@ class TROff(app.MainDiv):
 
     def __start_idle_demo(self):
         self.__idle_timeout_id = None
+        if self.__snapshots is not None and self.__rewind_view.is_shown:
+            self.__rewind_view.hide()
         avg.Anim.fadeOut(self.__game_div, 200)
         self.__ctrl_div.sensitive = False
         for player_ in self.__idle_players:
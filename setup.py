@@ -1,7 +1,22 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import imp
+import os
 from setuptools import setup
+from setuptools.command.build_py import build_py
+
+
+class BuildPyWithAssets(build_py):
+    # packs the assets into a single bundle next to the loose files
+    def run(self):
+        build_py.run(self)
+        # load the module directly, importing the package would require libavg
+        assets = imp.load_source('mttroff_assets', os.path.join('mttroff', 'assets.py'))
+        bundle_path = os.path.join(self.build_lib, 'mttroff', assets.BUNDLE_PATH)
+        self.mkpath(os.path.dirname(bundle_path))
+        self.execute(assets.build_bundle, ('mttroff', bundle_path), 'building asset bundle %s' % bundle_path)
+
 
 setup(
     name='TROff',
@@ -13,6 +28,7 @@ setup(
     packages=['mttroff'],
     scripts=['scripts/mttroff'],
     package_data={
-        'mttroff': ['media/preview.png', 'media/*.wav', 'data/*.pickle', 'fonts/Ubuntu-R.ttf']
-    }
+        'mttroff': ['media/preview.png', 'media/*.wav', 'data/*.pickle', 'data/maps/*.map', 'fonts/Ubuntu-R.ttf']
+    },
+    cmdclass={'build_py': BuildPyWithAssets}
 )